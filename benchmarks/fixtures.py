@@ -0,0 +1,354 @@
+"""
+Build synthetic EVE client, laid out the way Phobos expects to find it, with
+data in all formats miners read. Contents are generated from a seed, thus the
+same scale always produces the same files.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import random
+import shutil
+import sqlite3
+import struct
+import zlib
+from collections import namedtuple
+
+
+# Languages localization data is generated for
+LANGUAGES = ('en-us', 'de')
+
+# Directory layout of MachoNet cache, server IP is picked by miners automatically
+# when there is single server directory
+MACHONET_SERVER = '127.0.0.1'
+MACHONET_PROTOCOL = '1234'
+
+
+def build_client(root, scale, seed=0):
+    """
+    Generate client with roughly `scale` rows in every container into passed directory.
+    Returns paths to EVE client directory and to cache directory.
+    """
+    path_eve = os.path.join(root, 'eve')
+    path_cache = os.path.join(root, 'cache')
+    for path in (path_eve, path_cache):
+        shutil.rmtree(path, ignore_errors=True)
+    rng = random.Random(seed)
+    resources = ResourceTree(path_eve)
+    resources.add('app:/start.ini', '[main]\nbuild = 1\n', app=True)
+    resources.add('res:/staticdata/types.static', encode_fsd_file(make_types(rng, scale), FSD_TYPES_SCHEMA))
+    resources.add_file('res:/staticdata/groups.static', lambda path: write_fsdlite(path, make_groups(rng, scale)))
+    resources.add_file('res:/staticdata/inventory.db', lambda path: write_sqlite(path, make_types(rng, scale)))
+    for file_name, data in make_localization(scale):
+        resources.add('res:/localizationfsd/{}.pickle'.format(file_name), pickle.dumps(data, 2))
+    resources.write_indices()
+    write_machonet_cache(path_cache, rng, scale)
+    return path_eve, path_cache
+
+
+class ResourceTree(object):
+    """Stores resource files under hashed names and keeps index of them."""
+
+    def __init__(self, path_eve):
+        self._path_eve = path_eve
+        # Format: [(resource path, relative file path, md5 hash, size, compressed size)]
+        self._res_index = []
+        self._app_index = []
+
+    def add(self, resource_path, data, app=False):
+        self.add_file(resource_path, lambda path: self.__write(path, data), app=app)
+
+    def add_file(self, resource_path, writer, app=False):
+        """Add resource whose file is produced by passed function."""
+        name_hash = hashlib.md5(resource_path).hexdigest()
+        file_relpath = '{}/{}'.format(name_hash[:2], name_hash)
+        file_abspath = os.path.join(self._path_eve, 'ResFiles', *file_relpath.split('/'))
+        if not os.path.isdir(os.path.dirname(file_abspath)):
+            os.makedirs(os.path.dirname(file_abspath))
+        writer(file_abspath)
+        with open(file_abspath, 'rb') as f:
+            data = f.read()
+        entry = (resource_path, file_relpath, hashlib.md5(data).hexdigest(), len(data), len(data))
+        (self._app_index if app else self._res_index).append(entry)
+
+    def write_indices(self):
+        server_dir = os.path.join(self._path_eve, 'tq')
+        if not os.path.isdir(server_dir):
+            os.makedirs(server_dir)
+        with open(os.path.join(server_dir, 'resfileindex.txt'), 'wb') as f:
+            for entry in self._res_index:
+                f.write('{},{},{},{},{}\n'.format(*entry))
+        with open(os.path.join(self._path_eve, 'index_tranquility.txt'), 'wb') as f:
+            for entry in self._app_index:
+                f.write('{},{},{},{},{},1\n'.format(*entry))
+
+    def __write(self, path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+
+
+################################################################################################
+# Data
+################################################################################################
+def make_types(rng, count):
+    types = {}
+    for type_id in xrange(count):
+        types[type_id] = {
+            'typeID': type_id,
+            'groupID': rng.randint(0, count // 10),
+            'typeName': 'Type {}'.format(type_id),
+            'typeNameID': message_id(type_id),
+            'volume': rng.randint(1, 10000) / 4.0,
+            'published': rng.random() > 0.3,
+            'position': (rng.randint(-100, 100) / 2.0, 0.0, 1.5),
+            'materials': tuple(rng.randint(1, 50) for _ in xrange(rng.randint(0, 6)))}
+    return types
+
+
+def make_groups(rng, count):
+    groups = {}
+    for group_id in xrange(count):
+        groups[group_id] = {
+            'groupID': group_id,
+            'groupName': 'Group {}'.format(group_id),
+            'groupNameID': message_id(group_id),
+            'published': rng.random() > 0.5,
+            'traits': dict(('{}'.format(rng.randint(1, 500)), rng.random()) for _ in xrange(rng.randint(0, 4)))}
+    return groups
+
+
+def message_id(entity_id):
+    return 100000 + entity_id
+
+
+def make_localization(count):
+    """Return [(file name, data)] for localization pickles."""
+    files = [('localization_fsd_main', {'languages': list(LANGUAGES), 'labels': {}})]
+    for language in LANGUAGES:
+        messages = dict(
+            (message_id(i), (u'{} text {}'.format(language, i), None, None))
+            for i in xrange(count))
+        files.append(('localization_fsd_{}'.format(language), (language, messages)))
+    return files
+
+
+################################################################################################
+# SQLite & FSDLite
+################################################################################################
+def write_sqlite(path, types):
+    dbconn = sqlite3.connect(path)
+    dbconn.execute(
+        'create table invTypes (typeID integer primary key, groupID integer, typeName text, '
+        'typeNameID integer, volume real, published integer)')
+    dbconn.executemany('insert into invTypes values (?, ?, ?, ?, ?, ?)', (
+        (t['typeID'], t['groupID'], t['typeName'], t['typeNameID'], t['volume'], int(t['published']))
+        for t in types.itervalues()))
+    dbconn.commit()
+    dbconn.close()
+
+
+def write_fsdlite(path, rows):
+    dbconn = sqlite3.connect(path)
+    dbconn.execute('create table cache (key integer primary key, value text)')
+    dbconn.executemany('insert into cache values (?, ?)', ((k, json.dumps(v)) for k, v in rows.iteritems()))
+    dbconn.commit()
+    dbconn.close()
+
+
+################################################################################################
+# FSD binary
+################################################################################################
+FSD_INT_FOOTER = {
+    'type': 'list',
+    'itemTypes': {'type': 'object', 'attributes': {'key': {'type': 'int'}, 'offset': {'type': 'int'}}}}
+
+FSD_TYPES_SCHEMA = {
+    'type': 'dict',
+    'keyTypes': {'type': 'int', 'min': 0},
+    'keyFooter': FSD_INT_FOOTER,
+    'valueTypes': {
+        'type': 'object',
+        'attributes': {
+            'typeID': {'type': 'int', 'min': 0},
+            'groupID': {'type': 'int', 'min': 0},
+            'typeNameID': {'type': 'int', 'min': 0},
+            'volume': {'type': 'float'},
+            'published': {'type': 'bool'},
+            'position': {'type': 'vector3'},
+            'typeName': {'type': 'string'},
+            'materials': {'type': 'list', 'itemTypes': {'type': 'int', 'min': 0}, 'fixedItemSize': 4}},
+        'constantAttributeOffsets': {'typeID': 0, 'groupID': 4, 'typeNameID': 8, 'volume': 12, 'published': 16, 'position': 17},
+        'endOfFixedSizeData': 29,
+        'attributesWithVariableOffsets': ('typeName', 'materials')}}
+
+
+def encode_fsd_file(data, schema):
+    """Return contents of FSD binary file with embedded schema."""
+    schema_data = pickle.dumps(schema, 2)
+    return struct.pack('<I', len(schema_data)) + schema_data + encode_fsd_value(data, schema)
+
+
+def encode_fsd_value(value, schema):
+    """Encode value according to its schema, supports only what synthetic data needs."""
+    schema_type = schema['type']
+    if schema_type == 'int':
+        return struct.pack('<I' if schema.get('min', -1) >= 0 else '<i', value)
+    if schema_type == 'float':
+        return struct.pack('<d' if schema.get('precision') == 'double' else '<f', value)
+    if schema_type == 'bool':
+        return struct.pack('<B', 255 if value else 0)
+    if schema_type == 'string':
+        raw = value.encode('cp1252')
+        return struct.pack('<I', len(raw)) + raw
+    if schema_type == 'vector3':
+        return struct.pack('<fff', *value)
+    if schema_type == 'list':
+        return _encode_fsd_list(value, schema)
+    if schema_type == 'object':
+        return _encode_fsd_object(value, schema)
+    if schema_type == 'dict':
+        return _encode_fsd_dict(value, schema)
+    raise ValueError('encoding of FSD type {!r} is not supported'.format(schema_type))
+
+
+def _encode_fsd_list(value, schema):
+    items = [encode_fsd_value(i, schema['itemTypes']) for i in value]
+    if 'fixedItemSize' in schema:
+        return struct.pack('<I', len(items)) + ''.join(items)
+    # Item offsets are relative to start of the list
+    offsets = []
+    position = 4 + 4 * len(items)
+    for item in items:
+        offsets.append(position)
+        position += len(item)
+    return struct.pack('<I', len(items)) + struct.pack('<{}I'.format(len(offsets)), *offsets) + ''.join(items)
+
+
+def _encode_fsd_object(value, schema):
+    attributes = schema['attributes']
+    fixed = bytearray(schema.get('size', schema.get('endOfFixedSizeData', 0)))
+    for name, offset in schema['constantAttributeOffsets'].iteritems():
+        encoded = encode_fsd_value(value[name], attributes[name])
+        fixed[offset:offset + len(encoded)] = encoded
+    if 'size' in schema:
+        return str(fixed)
+    variable = []
+    offsets = []
+    position = 0
+    for name in schema['attributesWithVariableOffsets']:
+        encoded = encode_fsd_value(value[name], attributes[name])
+        offsets.append(position)
+        variable.append(encoded)
+        position += len(encoded)
+    # Fixed part is followed by mask of present optional attributes, and by offsets of variable ones
+    header = struct.pack('<Q', 0) + struct.pack('<{}I'.format(len(offsets)), *offsets)
+    return str(fixed) + header + ''.join(variable)
+
+
+def _encode_fsd_dict(value, schema):
+    items = []
+    footer = [struct.pack('<I', len(value))]
+    position = 0
+    for key in sorted(value):
+        encoded = encode_fsd_value(value[key], schema['valueTypes'])
+        footer.append(struct.pack('<ii', key, position))
+        items.append(encoded)
+        position += len(encoded)
+    footer = ''.join(footer)
+    size = 4 + position + len(footer)
+    return struct.pack('<I', size) + ''.join(items) + footer + struct.pack('<I', len(footer))
+
+
+################################################################################################
+# MachoNet
+################################################################################################
+MarshalInstance = namedtuple('MarshalInstance', ('guid', 'state'))
+
+
+def write_machonet_cache(path_cache, rng, count):
+    protocol_dir = os.path.join(path_cache, 'MachoNet', MACHONET_SERVER, MACHONET_PROTOCOL)
+    calls_dir = os.path.join(protocol_dir, 'CachedMethodCalls')
+    objects_dir = os.path.join(protocol_dir, 'CachedObjects')
+    for directory in (calls_dir, objects_dir):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    rows = [
+        MarshalInstance('utillib.KeyVal', {
+            'typeID': i,
+            'typeName': u'Type {}'.format(i),
+            'typeNameID': message_id(i),
+            'price': rng.random() * 10 ** 6,
+            'stock': long(rng.randint(0, 10 ** 12)) if i % 7 else None})
+        for i in xrange(count)]
+    call_entity = (('marketProxy', 'GetPrices'), {'lret': rows, 'version': (1, 1)})
+    with open(os.path.join(calls_dir, 'prices.cache'), 'wb') as f:
+        f.write(marshal_dumps(call_entity))
+    object_entity = (('stations', 1), MarshalInstance('objectCaching.CachedObject', (
+        (1, 1), None, 123, 0, zlib.compress(marshal_dumps(make_stations(rng, count))), 1)))
+    with open(os.path.join(objects_dir, 'stations.cache'), 'wb') as f:
+        f.write(marshal_dumps(object_entity))
+
+
+def make_stations(rng, count):
+    """Return payload of cached object."""
+    return dict((i, (u'Station {}'.format(i), i * 3, rng.random() > 0.5)) for i in xrange(count))
+
+
+def marshal_dumps(obj, checksum=False):
+    """Serialize object into marshal stream without shared objects, optionally with checksum of its body."""
+    chunks = []
+    _marshal_object(obj, chunks)
+    body = ''.join(chunks)
+    if checksum:
+        body = chr(28) + struct.pack('<i', zlib.adler32(body)) + body
+    return '~' + struct.pack('<i', 0) + body
+
+
+def _marshal_length(length, chunks):
+    if length < 255:
+        chunks.append(chr(length))
+    else:
+        chunks.append('\xff' + struct.pack('<i', length))
+
+
+def _marshal_object(obj, chunks):
+    # Type tags are defined in miner.macho_net.unmarshal.unmarshaller.Type
+    if obj is None:
+        chunks.append(chr(1))
+    elif obj is True:
+        chunks.append(chr(31))
+    elif obj is False:
+        chunks.append(chr(32))
+    elif isinstance(obj, (int, long)) and -2 ** 31 <= obj < 2 ** 31:
+        chunks.append(chr(4) + struct.pack('<i', obj))
+    elif isinstance(obj, (int, long)):
+        chunks.append(chr(3) + struct.pack('<q', obj))
+    elif isinstance(obj, float):
+        chunks.append(chr(10) + struct.pack('<d', obj))
+    elif isinstance(obj, str):
+        chunks.append(chr(13))
+        _marshal_length(len(obj), chunks)
+        chunks.append(obj)
+    elif isinstance(obj, unicode):
+        chunks.append(chr(18))
+        _marshal_length(len(obj), chunks)
+        chunks.append(obj.encode('utf-16-le'))
+    elif isinstance(obj, MarshalInstance):
+        chunks.append(chr(23))
+        _marshal_object(obj.guid, chunks)
+        _marshal_object(obj.state, chunks)
+    elif isinstance(obj, (tuple, list)):
+        chunks.append(chr(20 if isinstance(obj, tuple) else 21))
+        _marshal_length(len(obj), chunks)
+        for item in obj:
+            _marshal_object(item, chunks)
+    elif isinstance(obj, dict):
+        chunks.append(chr(22))
+        _marshal_length(len(obj), chunks)
+        # Value goes before its key
+        for key, value in obj.iteritems():
+            _marshal_object(value, chunks)
+            _marshal_object(key, chunks)
+    else:
+        raise TypeError('marshalling of {} is not supported'.format(type(obj).__name__))
@@ -0,0 +1,108 @@
+"""
+Time EveNormalizer over synthetic trees, shaped like data FSD and MachoNet
+miners hand over to it. Cases are run by benchmark suite as well, or alone
+from repository root:
+
+    $ python -m benchmarks.normalizer --types 20000 --repeat 5
+"""
+
+import argparse
+import random
+import sys
+import timeit
+
+from miner.macho_net.unmarshal.unmarshaller import MarshalObject
+from util import EveNormalizer
+
+
+class FSD_Dict(object):
+    """Mimics map exposed by FSD loaders."""
+    __guid__ = 'FSD_Dict'
+
+    def __init__(self, data):
+        self._data = data
+
+    def iteritems(self):
+        return self._data.iteritems()
+
+
+class FSD_Object(object):
+    """Mimics object exposed by FSD loaders."""
+    __guid__ = 'FSD_Object'
+
+    def __init__(self, **kwargs):
+        self.attributes = tuple(kwargs)
+        self.__dict__.update(kwargs)
+
+
+def make_tree(type_count, seed=0):
+    rng = random.Random(seed)
+    types = {}
+    for type_id in xrange(type_count):
+        attributes = dict(
+            (rng.randint(1, 3000), rng.random() * 1000)
+            for _ in xrange(rng.randint(5, 40)))
+        types[type_id] = FSD_Object(
+            typeID=type_id,
+            groupID=rng.randint(1, 1500),
+            typeName='Type {}'.format(type_id),
+            typeNameID=rng.randint(1, 10 ** 6),
+            published=rng.random() > 0.3,
+            position=(rng.random(), rng.random(), rng.random()),
+            dogmaAttributes=FSD_Dict(attributes),
+            materials=[{'materialTypeID': rng.randint(1, 50), 'quantity': rng.randint(1, 10 ** 5)} for _ in xrange(3)],
+            extra=MarshalObject('utillib.KeyVal', state={'name': 'kv', 'values': [1, 2, 3]}))
+    return FSD_Dict(types)
+
+
+def make_deep(depth):
+    root = leaf = []
+    for _ in xrange(depth):
+        child = [{'level': 'x'}]
+        leaf.append(child)
+        leaf = child
+    return root
+
+
+def make_native(row_count, seed=0):
+    """Rows made of python built-in types only, like most of unmarshalled MachoNet data."""
+    rng = random.Random(seed)
+    return tuple(
+        {u'typeID': type_id,
+         u'price': rng.random() * 10 ** 6,
+         u'location': (rng.random(), rng.random(), rng.random()),
+         u'attributes': dict((rng.randint(1, 3000), rng.random()) for _ in xrange(10))}
+        for type_id in xrange(row_count))
+
+
+def case_iter(type_count, depth):
+    """
+    Yield normalizer benchmark cases, which are also part of benchmark suite.
+    Format: (case name, function to measure)
+    """
+    native = make_native(type_count)
+    # Format: ((case name, data, normalizer arguments))
+    cases = (
+        ('fsd-like tree', make_tree(type_count), {}),
+        ('nested lists', make_deep(depth), {}),
+        ('native rows, copied', native, {}),
+        ('native rows, reused', native, {'reuse_native': True}))
+    for name, data, kwargs in cases:
+        yield name, lambda data=data, kwargs=kwargs: EveNormalizer(**kwargs).run(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark EveNormalizer over synthetic data')
+    parser.add_argument('--types', type=int, default=20000, help='Amount of types in synthetic tree')
+    parser.add_argument('--depth', type=int, default=5000, help='Nesting depth of deep container case')
+    parser.add_argument('--repeat', type=int, default=5, help='Amount of timed runs, best is reported')
+    args = parser.parse_args()
+
+    sys.stdout.write('{} types, depth {}\n'.format(args.types, args.depth))
+    for name, function in case_iter(args.types, args.depth):
+        timings = timeit.repeat(function, number=1, repeat=args.repeat)
+        sys.stdout.write('{}: best {:.3f}s, worst {:.3f}s\n'.format(name, min(timings), max(timings)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+Time miners, translator, normalizer and JSON writer over synthetic client data,
+and compare results with previous runs. Run from repository root:
+
+    $ python -m benchmarks.suite --scale 20000 --save results.json
+    $ python -m benchmarks.suite --scale 20000 --compare results.json
+"""
+
+import argparse
+import copy
+import json
+import os.path
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+import zlib
+
+from benchmarks import normalizer
+from benchmarks.fixtures import build_client, make_stations, marshal_dumps
+from miner import (
+    FsdBinaryMiner, FsdLiteMiner, MachoNetCallsMiner, MachoNetObjectsMiner, PickleMiner, SqliteMiner)
+from miner.macho_net.unmarshal import Unmarshaller
+from util import ResourceBrowser, SqlitePool, Translator
+from writer import JsonWriter
+
+
+# Nesting depth of normalizer case with deeply nested containers
+NORMALIZER_DEPTH = 5000
+
+
+class Suite(object):
+    """
+    Set of benchmark cases over client in passed directories. Every case
+    is a method which prepares everything it needs, and returns function
+    whose run time is measured.
+    """
+
+    def __init__(self, path_eve, path_cache, path_output, scale):
+        self._path_eve = path_eve
+        self._path_cache = path_cache
+        self._path_output = path_output
+        self._scale = scale
+
+    def case_iter(self):
+        for name, method in self._cases:
+            yield name, method.__get__(self)
+        # Normalizer is measured on its own synthetic trees, of the same size as containers
+        for name, function in normalizer.case_iter(self._scale, NORMALIZER_DEPTH):
+            yield u'normalizer: {}'.format(name), lambda function=function: function
+
+    # Miners, every run reads all containers of a miner from scratch
+
+    def _case_fsd_binary(self):
+        return lambda: self._load_all(FsdBinaryMiner(resbrowser=self._resbrowser, translator=self._translator))
+
+    def _case_fsd_lite(self):
+        def run():
+            with SqlitePool() as dbpool:
+                self._load_all(FsdLiteMiner(resbrowser=self._resbrowser, translator=self._translator, dbpool=dbpool))
+        return run
+
+    def _case_sqlite(self):
+        def run():
+            with SqlitePool() as dbpool:
+                self._load_all(SqliteMiner(resbrowser=self._resbrowser, translator=self._translator, dbpool=dbpool))
+        return run
+
+    def _case_pickle(self):
+        return lambda: self._load_all(PickleMiner(resbrowser=self._resbrowser))
+
+    def _case_mn_calls(self):
+        return lambda: self._load_all(MachoNetCallsMiner(
+            path_cache=self._path_cache, server_ip=None, translator=self._translator))
+
+    def _case_mn_objects(self):
+        return lambda: self._load_all(MachoNetObjectsMiner(
+            path_cache=self._path_cache, server_ip=None, translator=self._translator))
+
+    # Unmarshaller over compressed payload of cached object, the way objects miner reads it
+
+    def _case_unmarshal_compressed(self):
+        return self._unmarshal_compressed(checksum=False)
+
+    def _case_unmarshal_checksummed(self):
+        return self._unmarshal_compressed(checksum=True)
+
+    # Processing stages, measured on data loaded in advance
+
+    def _case_translator(self):
+        data = self._load_rows()
+        translator = Translator(pickle_miner=PickleMiner(resbrowser=self._resbrowser))
+        # Load localization data before measurement starts
+        translator.translate_container(copy.deepcopy(data), u'de')
+        # Translation changes data in place, thus it gets fresh copy every run
+        copies = []
+
+        def run():
+            translator.translate_container(copies.pop(), u'de')
+        run.prepare = lambda: copies.append(copy.deepcopy(data))
+        return run
+
+    def _case_json_writer(self):
+        data = self._load_rows()
+        writer = JsonWriter(self._path_output, indent=2)
+        return lambda: writer.write(miner_name='benchmark', container_name='types', container_data=data)
+
+    _cases = (
+        ('miner: fsd_binary', _case_fsd_binary),
+        ('miner: fsd_lite', _case_fsd_lite),
+        ('miner: sqlite', _case_sqlite),
+        ('miner: pickle', _case_pickle),
+        ('miner: mn_cached_calls', _case_mn_calls),
+        ('miner: mn_cached_objects', _case_mn_objects),
+        ('unmarshaller: compressed payload', _case_unmarshal_compressed),
+        ('unmarshaller: compressed payload with checksum', _case_unmarshal_checksummed),
+        ('translator', _case_translator),
+        ('json writer', _case_json_writer))
+
+    @property
+    def _resbrowser(self):
+        # Fresh browser every time, so that nothing is cached between runs
+        return ResourceBrowser(eve_path=self._path_eve, server_alias='tq')
+
+    @property
+    def _translator(self):
+        return Translator(pickle_miner=PickleMiner(resbrowser=self._resbrowser))
+
+    def _load_all(self, miner):
+        for container_name in miner.contname_iter():
+            miner.get_data(container_name=container_name)
+
+    def _unmarshal_compressed(self, checksum):
+        payload = zlib.compress(marshal_dumps(make_stations(random.Random(0), self._scale), checksum=checksum))
+        return lambda: Unmarshaller(payload, compressed=True).load()
+
+    def _load_rows(self):
+        """Return container which looks like typical row-based data."""
+        miner = FsdBinaryMiner(resbrowser=self._resbrowser, translator=self._translator)
+        return miner.get_data(container_name='types').values()
+
+
+def measure(function, repeat):
+    """
+    Run function several times, return list of run times. If function has
+    prepare attribute, it is called before every run, and is not measured.
+    """
+    timings = []
+    prepare = getattr(function, 'prepare', None)
+    for _ in xrange(repeat):
+        if prepare is not None:
+            prepare()
+        started = timeit.default_timer()
+        function()
+        timings.append(timeit.default_timer() - started)
+    return timings
+
+
+def compare(results, baseline, threshold):
+    """Print difference with baseline, return names of cases which got slower than threshold allows."""
+    regressions = []
+    for name, result in sorted(results['cases'].iteritems()):
+        try:
+            previous = baseline['cases'][name]['best']
+        except KeyError:
+            continue
+        change = (result['best'] - previous) / previous if previous else 0.0
+        sys.stdout.write('{}: {:+.1%} against baseline\n'.format(name, change))
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Phobos over synthetic client data')
+    parser.add_argument('--scale', type=int, default=20000, help='Amount of rows in every synthetic container')
+    parser.add_argument('--repeat', type=int, default=5, help='Amount of timed runs of every case, best is reported')
+    parser.add_argument('--fixtures', default=None, help='Directory to generate client into and keep, temporary by default')
+    parser.add_argument('--save', default=None, help='Save results into this file')
+    parser.add_argument('--compare', default=None, help='Compare results with ones saved into this file earlier')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Slowdown against baseline which is reported as regression. Default is 0.1 (10%%)')
+    args = parser.parse_args()
+
+    root = args.fixtures or tempfile.mkdtemp(prefix='phobos-bench-')
+    try:
+        path_eve, path_cache = build_client(root, args.scale)
+        suite = Suite(path_eve, path_cache, os.path.join(root, 'output'), args.scale)
+        # Format: {case name: {stat name: value}}
+        cases = {}
+        for name, case in suite.case_iter():
+            timings = measure(case(), args.repeat)
+            cases[name] = {'best': min(timings), 'worst': max(timings), 'timings': timings}
+            sys.stdout.write('{}: best {:.3f}s, worst {:.3f}s\n'.format(name, min(timings), max(timings)))
+    finally:
+        if args.fixtures is None:
+            shutil.rmtree(root, ignore_errors=True)
+    results = {
+        'scale': args.scale,
+        'repeat': args.repeat,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cases': cases}
+    if args.save:
+        with open(args.save, 'wb') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare, 'rb') as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != args.scale:
+            sys.stdout.write('baseline was measured with scale {}, comparison is not meaningful\n'.format(baseline.get('scale')))
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            sys.stdout.write('regressions: {}\n'.format(', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
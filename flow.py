@@ -1,4 +1,12 @@
+import gc
 import re
+from contextlib import contextmanager
+
+from miner import RowFilter
+from pipeline import WritePipeline
+from scheduler import Scheduler
+from util import get_current_rss, stage_stats
+from writer.canonical import canonicalize
 
 
 class FlowManager(object):
@@ -6,55 +14,344 @@ class FlowManager(object):
     Class for handling high-level flow of script.
     """
 
-    def __init__(self, miners, writers):
+    def __init__(
+            self, miners, writers, chunk_size=None, progress=False, profiler=None, memory_budget=None, caches=(),
+            releasers=None, translator=None, language_writers=None, write_queue_size=None):
         self._miners = miners
         self._writers = writers
+        # When set, containers which can be fetched as chunks of rows are
+        # passed to writers chunk by chunk, rather than loaded as a whole
+        self._chunk_size = chunk_size
+        # When set, time spent on every stage is printed after container is processed
+        self._progress = progress
+        # When set, processing of every container is profiled with it
+        self._profiler = profiler
+        # When set, caches are dropped whenever process occupies more memory
+        # than this amount of bytes
+        self._memory_budget = memory_budget
+        # Memory occupied right after caches were released last time; until
+        # process grows beyond it, releasing again would not free anything
+        self._memory_floor = None
+        # Objects besides miners which keep caches, and can release them
+        self._caches = caches
+        # Functions which release inputs shared by containers, after the last
+        # container which needs them is processed
+        # Format: {input kind: function}
+        self._releasers = releasers or {}
+        # When set, every container is fetched once, and its copy translated
+        # into every language is passed to writers of that language, instead
+        # of passed writers. Translator is needed to do that
+        # Format: {language: [writer]}
+        self._language_writers = language_writers
+        self._translator = translator
+        # When set, data is written in separate thread, while next container
+        # is fetched; this amount of writing jobs can wait in queue at most
+        self._write_queue_size = write_queue_size
+        self._pipeline = None
 
     def run(self, filter_string, language):
-        filter_set = self._parse_filter(name_filter=filter_string)
+        # Format: [(miner, [container name])]
+        miner_containers = []
+        # Format: {miner: [discovery error]}
+        discovery_errors = {}
+        for miner in self._get_miner_order():
+            # Everything miner does before processing any container is
+            # accounted as its discovery
+            with stage_stats.container(miner.name, None), stage_stats.stage(u'discovery'):
+                discovery_errors[miner] = list(miner.discovery_error_iter())
+                miner_containers.append((miner, list(miner.contname_iter())))
+        # Names of containers can contain parenthesis themselves, thus they
+        # are needed to tell row filters apart from names
+        known_names = set(cn for _, container_names in miner_containers for cn in container_names)
+        filter_set, row_filters = self._parse_filter(name_filter=filter_string, known_names=known_names)
         missing_set = set(filter_set)
-        for miner in self._miners:
-            discovery_errors = list(miner.discovery_error_iter())
+        # Format: [(miner, container name, [input])]
+        jobs = []
+        for miner, container_names in miner_containers:
             # Filter something out only if filter was actually specified
-            container_names = [
-                cn for cn in miner.contname_iter()
-                if not filter_set or cn in filter_set]
-            # Do not announce miner if there is no data from it whatsoever
-            if not container_names and not discovery_errors:
-                continue
-            print(u'Miner {}:'.format(miner.raw_name))
-            for discovery_error in discovery_errors:
-                print(u'  discovery failed, {}'.format(discovery_error))
+            container_names = [cn for cn in container_names if not filter_set or cn in filter_set]
             for container_name in sorted(container_names):
-                print(u'  processing {}'.format(container_name))
                 missing_set.discard(container_name)
-                # Fetch data from client
-                try:
-                    container_data = miner.get_data(container_name=container_name, language=language, verbose=True)
-                except (KeyboardInterrupt, SystemExit):
-                    raise
-                except Exception as e:
-                    print(u'    unable to fetch data - {}: {}'.format(type(e).__name__, e))
-                else:
-                    # Write data using passed writers
-                    for writer in self._writers:
-                        try:
-                            writer.write(miner_name=miner.name, container_name=container_name, container_data=container_data)
-                        except (KeyboardInterrupt, SystemExit):
-                            raise
-                        except Exception as e:
-                            print(u'    unable to write data with {} - {}: {}'.format(type(writer).__name__, type(e).__name__, e))
+                jobs.append((miner, container_name, self._get_inputs(miner, container_name, language)))
+            # Miners which have nothing but errors are announced right away
+            if not container_names and discovery_errors[miner]:
+                self._announce_miner(miner, discovery_errors.pop(miner))
+        if self._write_queue_size:
+            self._pipeline = WritePipeline(self._write_queue_size)
+        try:
+            current_miner = None
+            for miner, container_name in Scheduler(jobs, releasers=self._get_releasers()).job_iter():
+                # Containers of different miners can be interleaved, thus miner is
+                # announced every time it changes
+                if miner is not current_miner:
+                    self._announce_miner(miner, discovery_errors.pop(miner, ()))
+                    current_miner = miner
+                print(u'  processing {}'.format(container_name))
+                with stage_stats.container(miner.name, container_name), self._profile(miner.name, container_name):
+                    self._process_container(miner, container_name, language, row_filters.get(container_name))
+                if self._progress:
+                    print(u'    {}'.format(stage_stats.format_container(miner.name, container_name)))
+                if self._memory_budget is not None:
+                    self._enforce_memory_budget()
+        finally:
+            # Data which is already fetched is written even if run is interrupted
+            if self._pipeline is not None:
+                self._pipeline.close()
+                self._pipeline = None
         # Print info messages about requested, but unavailable containers
         if missing_set:
             print(u'Containers which were requested, but are not available:')
             for flow_name in sorted(missing_set):
                 print(u'  {}'.format(flow_name))
 
-    def _parse_filter(self, name_filter):
+    def _announce_miner(self, miner, discovery_errors):
+        print(u'Miner {}:'.format(miner.raw_name))
+        for discovery_error in discovery_errors:
+            print(u'  discovery failed, {}'.format(discovery_error))
+
+    def _get_inputs(self, miner, container_name, language):
+        """
+        Return inputs of container. Every container additionally needs its
+        miner, thus miner is released after its last container.
+        """
+        languages = [language] if self._language_writers is None else sorted(self._language_writers)
+        try:
+            inputs = []
+            for input_language in languages:
+                inputs.extend(miner.get_inputs(container_name, input_language))
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        # Failure will be reported when container is processed
+        except Exception:
+            inputs = []
+        inputs.append(('miner', miner))
+        return inputs
+
+    def _get_releasers(self):
+        releasers = dict(self._releasers)
+        if self._memory_budget is not None:
+            # Miners which need this one will compose its caches again
+            releasers['miner'] = lambda miner: miner.release_caches()
+        return releasers
+
+    def _get_miner_order(self):
+        """
+        Under memory budget, miners which translate data go first, so that
+        language data is released before the rest is processed.
+        """
+        if self._memory_budget is None:
+            return self._miners
+        return sorted(self._miners, key=lambda m: not m.uses_translator)
+
+    def _enforce_memory_budget(self):
+        """
+        Drop data caches if process occupies more memory than allowed, and
+        it has grown since they were dropped last time.
+        """
+        rss = get_current_rss()
+        if rss is None or rss <= max(self._memory_budget, self._memory_floor):
+            return
+        released = False
+        for cache in self._miners + list(self._caches):
+            if cache.release_caches():
+                released = True
+        if not released:
+            return
+        gc.collect()
+        self._memory_floor = get_current_rss()
+        print(u'    memory budget exceeded ({} MB used), caches released'.format(rss // (1024 * 1024)))
+
+    def _process_container(self, miner, container_name, language, row_filter):
+        """Fetch data of single container and pass it to writers."""
+        if row_filter is not None and not miner.supports_row_filter:
+            print(u'    unable to fetch data - rows of this container cannot be filtered')
+            return
+        for fetch_language, targets in self._get_fetch_plan(miner, language):
+            self._fetch_container(miner, container_name, fetch_language, targets, row_filter)
+
+    def _get_fetch_plan(self, miner, language):
+        """
+        Return list of fetches container needs.
+        Format: [(language to fetch container in, [(language to translate fetched data into, [writer])])]
+        """
+        if self._language_writers is None:
+            return [(language, [(None, self._writers)])]
+        language_writers = sorted(self._language_writers.items())
+        # Data is the same for every language
+        if not miner.uses_translator:
+            return [(None, [(None, writers) for _, writers in language_writers])]
+        if miner.translatable_after_fetch:
+            return [(None, language_writers)]
+        return [(l, [(None, writers)]) for l, writers in language_writers]
+
+    def _fetch_container(self, miner, container_name, language, targets, row_filter):
+        if self._chunk_size:
+            with stage_stats.stage(u'decoding'):
+                if self._stream_container(miner, container_name, language, targets, row_filter):
+                    return
+        # Fetch data from client
+        try:
+            with stage_stats.stage(u'decoding'):
+                container_data = miner.get_data(
+                    container_name=container_name, language=language, verbose=True, row_filter=row_filter)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception as e:
+            print(u'    unable to fetch data - {}: {}'.format(type(e).__name__, e))
+            return
+        for translate_language, writers in targets:
+            try:
+                target_data = self._translate(container_data, translate_language)
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except Exception as e:
+                print(u'    unable to translate data into {} - {}: {}'.format(translate_language, type(e).__name__, e))
+                continue
+            # Data is sorted once, rather than by every writer on its own
+            with stage_stats.stage(u'canonicalization'):
+                target_data = canonicalize(target_data)
+            self._submit(self._write_container, miner.name, container_name, writers, target_data)
+
+    def _submit(self, function, *args):
+        """Run writing job, in writing thread if there is one."""
+        if self._pipeline is None:
+            function(*args)
+        else:
+            self._pipeline.submit(function, *args)
+
+    def _write_container(self, miner_name, container_name, writers, container_data):
+        """Write data using passed writers."""
+        with stage_stats.container(miner_name, container_name):
+            for writer in writers:
+                try:
+                    with stage_stats.stage(u'writing'):
+                        writer.write(miner_name=miner_name, container_name=container_name, container_data=container_data)
+                except (KeyboardInterrupt, SystemExit):
+                    raise
+                except Exception as e:
+                    self._print_write_error(container_name, writer, e)
+
+    def _print_write_error(self, container_name, writer, e):
+        # In writing thread, container is written while others are processed
+        if self._pipeline is None:
+            print(u'    unable to write data with {} - {}: {}'.format(type(writer).__name__, type(e).__name__, e))
+        else:
+            print(u'    unable to write data of {} with {} - {}: {}'.format(
+                container_name, type(writer).__name__, type(e).__name__, e))
+
+    def _translate(self, container_data, language):
+        """Return copy of data translated into passed language, or data itself if there is no language."""
+        if not language:
+            return container_data
+        return self._translator.translate_copy(container_data, language)
+
+    @contextmanager
+    def _profile(self, miner_name, container_name):
+        if self._profiler is None:
+            yield
+        else:
+            with self._profiler.profile(miner_name, container_name):
+                yield
+
+    def _stream_container(self, miner, container_name, language, targets, row_filter):
+        """
+        Pass container data to writers chunk by chunk, if miner can
+        provide it this way. Return False if it cannot.
         """
-        Take filter string and return set of container names.
+        try:
+            chunks = miner.get_data_chunks(
+                container_name=container_name, language=language, verbose=True, chunk_size=self._chunk_size,
+                row_filter=row_filter)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception as e:
+            print(u'    unable to fetch data - {}: {}'.format(type(e).__name__, e))
+            return True
+        if chunks is None:
+            return False
+        # Sinks are opened, fed and closed by writing jobs, thus lists of sinks are filled by them
+        # Format: [(language to translate rows into, [(writer, sink)])]
+        target_sinks = [(translate_language, []) for translate_language, _ in targets]
+        for (_, writers), (_, sinks) in zip(targets, target_sinks):
+            self._submit(self._open_sinks, miner.name, container_name, writers, sinks)
+        try:
+            for chunk in chunks:
+                for translate_language, sinks in target_sinks:
+                    rows = self._translate(chunk, translate_language)
+                    with stage_stats.stage(u'canonicalization'):
+                        rows = canonicalize(rows)
+                    self._submit(self._write_rows, miner.name, container_name, sinks, rows)
+        except (KeyboardInterrupt, SystemExit):
+            self._submit(self._abort_sinks, target_sinks)
+            raise
+        except Exception as e:
+            print(u'    unable to fetch data - {}: {}'.format(type(e).__name__, e))
+            self._submit(self._abort_sinks, target_sinks)
+            return True
+        self._submit(self._close_sinks, miner.name, container_name, target_sinks)
+        return True
+
+    def _open_sinks(self, miner_name, container_name, writers, sinks):
+        with stage_stats.container(miner_name, container_name):
+            for writer in writers:
+                try:
+                    with stage_stats.stage(u'writing'):
+                        sinks.append((writer, writer.open_stream(miner_name=miner_name, container_name=container_name)))
+                except (KeyboardInterrupt, SystemExit):
+                    raise
+                except Exception as e:
+                    self._print_write_error(container_name, writer, e)
+
+    def _write_rows(self, miner_name, container_name, sinks, rows):
+        with stage_stats.container(miner_name, container_name):
+            for writer, sink in list(sinks):
+                try:
+                    with stage_stats.stage(u'writing'):
+                        sink.write_rows(rows)
+                except (KeyboardInterrupt, SystemExit):
+                    raise
+                except Exception as e:
+                    self._print_write_error(container_name, writer, e)
+                    sink.abort()
+                    sinks.remove((writer, sink))
+
+    def _close_sinks(self, miner_name, container_name, target_sinks):
+        with stage_stats.container(miner_name, container_name):
+            for _, sinks in target_sinks:
+                for writer, sink in sinks:
+                    try:
+                        with stage_stats.stage(u'writing'):
+                            sink.close()
+                    except (KeyboardInterrupt, SystemExit):
+                        raise
+                    except Exception as e:
+                        self._print_write_error(container_name, writer, e)
+
+    def _abort_sinks(self, target_sinks):
+        for _, sinks in target_sinks:
+            for _, sink in sinks:
+                sink.abort()
+
+    def _parse_filter(self, name_filter, known_names=()):
+        """
+        Take filter string and return set of container names, and map
+        between container names and filters for their rows. Names of
+        existing containers are taken as they are, even if they end
+        with something in parenthesis.
+
+        >>> manager = FlowManager(miners=(), writers=())
+        >>> names, row_filters = manager._parse_filter(
+        ...     u'marketProxy()_GetPrices()', known_names={u'marketProxy()_GetPrices()'})
+        >>> sorted(names), row_filters
+        ([u'marketProxy()_GetPrices()'], {})
+        >>> names, row_filters = manager._parse_filter(
+        ...     u'marketProxy()_GetPrices()(587), types(34)', known_names={u'marketProxy()_GetPrices()', u'types'})
+        >>> sorted(names), sorted(row_filters)
+        ([u'marketProxy()_GetPrices()', u'types'], [u'marketProxy()_GetPrices()', u'types'])
         """
         name_set = NameSet()
+        # Format: {container name: row filter}
+        row_filters = {}
         # Flag which indicates if we're within parenthesis
         # (are parsing argument substring)
         inarg = False
@@ -66,7 +363,7 @@ class FlowManager(object):
             pos_end = match.end()
             symbol = match.group()
             if symbol == ',' and inarg is False:
-                name_set.add(name_filter[pos_current:pos_start])
+                self.__add_segment(name_filter[pos_current:pos_start], known_names, name_set, row_filters)
                 pos_current = pos_end
             elif symbol == ',' and inarg is True:
                 continue
@@ -81,8 +378,76 @@ class FlowManager(object):
             msg = 'parenthesis is not closed'
             raise FilterParseError(msg)
         # Add last segment of string after last seen comma
-        name_set.add(name_filter[pos_current:])
-        return name_set
+        self.__add_segment(name_filter[pos_current:], known_names, name_set, row_filters)
+        return name_set, row_filters
+
+    # Container name followed by row filter arguments in parenthesis
+    _segment_regexp = re.compile(r'^(?P<name>.*)\((?P<args>[^()]*)\)$')
+
+    def __add_segment(self, segment, known_names, name_set, row_filters):
+        """
+        Add container name from filter segment to the set; arguments
+        in parenthesis after the name become filter for its rows.
+        """
+        segment = segment.strip()
+        if '(' not in segment or segment in known_names:
+            name_set.add(segment)
+            return
+        m = self._segment_regexp.match(segment)
+        # Parenthesis which are not at the end, or are empty and do not follow
+        # existing container name, are part of name
+        if m is None or (not m.group('args').strip() and m.group('name').strip() not in known_names):
+            name_set.add(segment)
+            return
+        name = m.group('name').strip()
+        if not name:
+            msg = u'row filter "{}" does not follow container name'.format(segment)
+            raise FilterParseError(msg)
+        name_set.add(name)
+        row_filters[name] = self._parse_row_filter(m.group('args'))
+
+    # Regular expressions to detect what kind of condition filter argument is
+    _predicate_regexp = re.compile(r'^(?P<column>\w+)\s*(?P<operator><=|>=|!=|<>|=|<|>)\s*(?P<value>.+)$', flags=re.UNICODE)
+    _range_regexp = re.compile(r'^(?P<low>.+?)\s*\.\.\s*(?P<high>.+)$')
+
+    def _parse_row_filter(self, args):
+        """
+        Take comma-separated filter arguments and return row filter. Each
+        argument is either a key (587), key range (587..600), or condition
+        on column value (groupID = 25).
+        """
+        keys = []
+        key_ranges = []
+        predicates = []
+        for arg in args.split(','):
+            arg = arg.strip()
+            if not arg:
+                continue
+            m = self._predicate_regexp.match(arg)
+            if m:
+                predicates.append((m.group('column'), m.group('operator'), self._parse_value(m.group('value'))))
+                continue
+            m = self._range_regexp.match(arg)
+            if m:
+                key_ranges.append((self._parse_value(m.group('low')), self._parse_value(m.group('high'))))
+                continue
+            keys.append(self._parse_value(arg))
+        return RowFilter(keys=keys, key_ranges=key_ranges, predicates=predicates)
+
+    def _parse_value(self, value):
+        """
+        Convert filter value into number if it looks like number, strip
+        quotes if it is quoted, leave it as-is otherwise.
+        """
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in ('"', "'"):
+            return value[1:-1]
+        for converter in (int, float):
+            try:
+                return converter(value)
+            except ValueError:
+                continue
+        return value
 
 
 class NameSet(set):
@@ -4,6 +4,7 @@ from .fsd_built import FsdBuiltMiner
 from .fsd_lite import FsdLiteMiner
 from .macho_net import MachoNetCallsMiner, MachoNetObjectsMiner
 from .metadata import MetadataMiner
+from .row_filter import RowFilter, RowFilterError
 from .sqlite import SqliteMiner
 from .traits import TraitMiner
 from .unpickle import PickleMiner
@@ -5,6 +5,21 @@ class BaseMiner(object):
     """Abstract class, which defines interface to all data miners used in Phobos."""
     __metaclass__ = ABCMeta
 
+    # Tells if miner can fetch only rows passed RowFilter lets through
+    supports_row_filter = False
+
+    # Tells if miner translates data it returns, thus keeps translator busy
+    uses_translator = False
+
+    # Tells if data fetched without language and translated afterwards is the
+    # same as data fetched with language, thus can be translated into several
+    # languages out of single fetch
+    translatable_after_fetch = False
+
+    # Names of cached properties which keep fetched data rather than results
+    # of discovery, thus can be dropped when memory is short
+    _releasable_caches = ()
+
     @abstractmethod
     def contname_iter(self):
         """Iterator over containers discovered by miner."""
@@ -15,6 +30,35 @@ class BaseMiner(object):
         """Fetch data from specified container."""
         raise NotImplementedError
 
+    def get_data_chunks(self, container_name, **kwargs):
+        """
+        Fetch data from specified container as iterator over lists of rows. Only
+        miners whose containers are plain lists of rows can do that, for the
+        rest it returns None as default implementation.
+        """
+        return None
+
+    def get_inputs(self, container_name, language=None):
+        """
+        Return list of inputs fetching of container needs, like languages
+        or other containers; see Scheduler for format. Nothing as default
+        implementation.
+        """
+        return []
+
+    def release_caches(self):
+        """
+        Forget data miner keeps to speed up subsequent requests, return True
+        if anything was dropped. Default implementation drops values of cached
+        properties listed in _releasable_caches; discovery maps are kept, as
+        composing them again means scanning client files once more.
+        """
+        released = False
+        for attr_name in self._releasable_caches:
+            if self.__dict__.pop(attr_name, None) is not None:
+                released = True
+        return released
+
     def discovery_error_iter(self):
         """No errors as default implementation."""
         return iter(())
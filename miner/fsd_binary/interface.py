@@ -10,6 +10,8 @@ class FsdBinaryMiner(BaseMiner):
     """Extract schema-driven FSD data from non-SQLite .static files."""
 
     name = 'fsd_binary'
+    uses_translator = True
+    translatable_after_fetch = True
 
     def __init__(self, resbrowser, translator):
         self._resbrowser = resbrowser
@@ -33,6 +35,9 @@ class FsdBinaryMiner(BaseMiner):
         self._translator.translate_container(data, language, verbose=verbose)
         return data
 
+    def get_inputs(self, container_name, language=None):
+        return self._translator.get_inputs(language)
+
     @cachedproperty
     def _contname_fsdfiles_map(self):
         """
@@ -15,6 +15,8 @@ from .base import BaseMiner
 class FsdBuiltMiner(BaseMiner):
 
     name = 'fsd_built'
+    uses_translator = True
+    translatable_after_fetch = True
 
     def __init__(self, resbrowser, translator):
         self._resbrowser = resbrowser
@@ -58,6 +60,9 @@ class FsdBuiltMiner(BaseMiner):
             self._translator.translate_container(normalized_data, language, verbose=verbose)
             return normalized_data
 
+    def get_inputs(self, container_name, language=None):
+        return self._translator.get_inputs(language)
+
     @cachedproperty
     def _contname_fsdfiles_map(self):
         """
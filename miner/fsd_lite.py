@@ -1,26 +1,52 @@
-import json
+import multiprocessing
 import re
-import sqlite3
+from collections import deque
+from itertools import izip
 
-from util import cachedproperty
+from util import SqlitePool, cachedproperty
 from .base import BaseMiner
 from .shared import has_sqlite_header
 
+try:
+    # Faster decoder is used when it's installed; without precise float parsing it rounds floats
+    # differently from standard library
+    import ujson
+
+    def json_loads(value):
+        return ujson.loads(value, precise_float=True)
+except ImportError:
+    from json import loads as json_loads
+
+
+# Amount of rows whose values are decoded as single job
+DECODE_BATCH_SIZE = 2000
+
+
+def decode_batch(values):
+    """Decode list of JSON values. Module-level, as it is run in worker processes."""
+    return [json_loads(value) for value in values]
+
 
 class FsdLiteMiner(BaseMiner):
     """Class, which fetches data from FSDLite format static cache files."""
 
     name = 'fsd_lite'
+    supports_row_filter = True
+    uses_translator = True
+    translatable_after_fetch = True
 
-    def __init__(self, resbrowser, translator):
+    def __init__(self, resbrowser, translator, dbpool=None, workers=1):
         self._resbrowser = resbrowser
         self._translator = translator
+        self._dbpool = dbpool if dbpool is not None else SqlitePool()
+        # Amount of processes which decode values of big containers
+        self._workers = workers
 
     def contname_iter(self):
         for container_name in sorted(self._contname_respath_map):
             yield container_name
 
-    def get_data(self, container_name, language=None, verbose=False, **kwargs):
+    def get_data(self, container_name, language=None, verbose=False, row_filter=None, **kwargs):
         try:
             resource_path = self._contname_respath_map[container_name]
         except KeyError:
@@ -28,17 +54,72 @@ class FsdLiteMiner(BaseMiner):
         else:
             rows = {}
             file_path = self._resbrowser.get_file_info(resource_path, verify_content=True).file_abspath
-            with sqlite3.connect(file_path) as dbconn:
-                c = dbconn.cursor()
-                c.execute(u'select key, value from cache')
-                for sqlite_row in c:
-                    key = sqlite_row[0]
-                    value = sqlite_row[1]
-                    row = json.loads(value)
-                    rows[key] = row
+            query = u'select key, value from cache'
+            params = []
+            # Values are opaque JSON to SQLite, thus only keys can be filtered on
+            if row_filter is not None:
+                condition, params = row_filter.get_sql(u'key', ())
+                if condition:
+                    query = u'{} where {}'.format(query, condition)
+            c = self._dbpool.get(file_path).cursor()
+            try:
+                c.execute(query, params)
+                for keys, values in self._decode_batches(c):
+                    rows.update(izip(keys, values))
+            finally:
+                c.close()
             self._translator.translate_container(rows, language, verbose=verbose)
             return rows
 
+    def get_inputs(self, container_name, language=None):
+        inputs = self._translator.get_inputs(language)
+        try:
+            resource_path = self._contname_respath_map[container_name]
+        except KeyError:
+            return inputs
+        inputs.append(('database', self._resbrowser.get_file_info(resource_path, verify_content=False).file_abspath))
+        return inputs
+
+    def _decode_batches(self, cursor):
+        """
+        Fetch rows from cursor in batches, and yield keys and decoded values
+        of every batch, in the order of rows. Batches are decoded as they
+        are fetched, spread across worker processes if there is more than
+        one batch, thus only few batches of raw values are held at once.
+        Format: ([key], [value])
+        """
+        pool = None
+        # Batches which are being decoded by workers
+        # Format: deque([([key], async result or [raw value])])
+        pending = deque()
+        try:
+            for sqlite_rows in iter(lambda: cursor.fetchmany(DECODE_BATCH_SIZE), []):
+                keys = [sqlite_row[0] for sqlite_row in sqlite_rows]
+                values = [sqlite_row[1] for sqlite_row in sqlite_rows]
+                if self._workers <= 1:
+                    yield keys, decode_batch(values)
+                    continue
+                # First batch waits for the second one, so that workers are not
+                # started for containers which fit into single batch
+                if pool is None and not pending:
+                    pending.append((keys, values))
+                    continue
+                if pool is None:
+                    pool = multiprocessing.Pool(self._workers)
+                    first_keys, first_values = pending.popleft()
+                    pending.append((first_keys, pool.apply_async(decode_batch, (first_values,))))
+                pending.append((keys, pool.apply_async(decode_batch, (values,))))
+                # Couple of batches per worker is enough to keep them all busy
+                if len(pending) >= self._workers * 2:
+                    keys, result = pending.popleft()
+                    yield keys, result.get()
+            while pending:
+                keys, result = pending.popleft()
+                yield keys, decode_batch(result) if pool is None else result.get()
+        finally:
+            if pool is not None:
+                pool.terminate()
+
     @cachedproperty
     def _contname_respath_map(self):
         """
@@ -74,15 +155,14 @@ class FsdLiteMiner(BaseMiner):
             # Quick & cheap way to check if it contains any SQLite database
             if not has_sqlite_header(file_path):
                 return False
-            dbconn = sqlite3.connect(file_path)
-            c = dbconn.cursor()
-            c.execute('select count(*) from sqlite_master where type = \'table\' and name = \'cache\'')
+            c = self._dbpool.get(file_path).cursor()
+            try:
+                c.execute('select count(*) from sqlite_master where type = \'table\' and name = \'cache\'')
+                rows = c.fetchall()
+            finally:
+                c.close()
         except (KeyboardInterrupt, SystemExit):
             raise
         except:
-            has_cache = False
-        else:
-            has_cache = False
-            for row in c:
-                has_cache = bool(row[0])
-        return has_cache
+            return False
+        return bool(rows and rows[0][0])
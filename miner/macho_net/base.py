@@ -3,7 +3,7 @@ import os
 import os.path
 from abc import abstractmethod, abstractproperty
 
-from util import EveNormalizer, cachedproperty
+from util import EveNormalizer, cachedproperty, stage_stats
 from miner.base import BaseMiner, DiscoveredData, DiscoveryError
 from .unmarshal import Unmarshaller
 
@@ -27,13 +27,26 @@ class MachoNetBase(BaseMiner):
     def _get_payload(self, cached_entity):
         raise NotImplementedError
 
+    # Tells if payload is part of the cached entity itself, or is stored in it as separate data
+    _inline_payload = True
+
+    uses_translator = True
+    translatable_after_fetch = True
+
     ################################################################################################
     # Non-abstract
     ################################################################################################
-    def __init__(self, path_cache, server_ip, translator):
+    def __init__(self, path_cache, server_ip, translator, verify_checksums=True, normalize_on_read=False):
         self._path_cache = path_cache
         self._server_ip = server_ip
         self._translator = translator
+        # Checksums embedded into cached data can be skipped for caches which are trusted
+        self._verify_checksums = verify_checksums
+        # Payload can be normalized by unmarshaller itself, saving a pass over the data. Unlike
+        # EveNormalizer, unmarshaller does not copy objects referred to more than once
+        self._normalize_on_read = normalize_on_read
+        # Format: {stat name: value}, for the container which is being read
+        self._unmarshal_stats = {}
 
     def discovery_error_iter(self):
         for discovery_error in self._contname_filepath_map.errors:
@@ -49,10 +62,25 @@ class MachoNetBase(BaseMiner):
         except KeyError:
             self._container_not_found(container_name)
             return
+        self._unmarshal_stats = {}
         unmarshalled_data = self._read_cached_entity_data(file_path)
-        normalized_data = EveNormalizer().run(unmarshalled_data)
-        self._translator.translate_container(normalized_data, language, verbose=verbose)
-        return normalized_data
+        self._report_unmarshal_stats()
+        if verbose:
+            self._print_unmarshal_stats()
+        # Data normalized on read still has to go through normalizer if unmarshaller came across
+        # objects it could not convert. Unmarshalled data is not used for anything else, thus
+        # normalizer can keep its parts which need no conversion instead of copying them
+        stats = self._unmarshal_stats
+        if not stats.get('normalized_streams') or stats.get('unresolved_objects'):
+            normalized_data = EveNormalizer(reuse_native=True).run(unmarshalled_data)
+        else:
+            normalized_data = unmarshalled_data
+        # Objects referred to more than once in marshal data can be the same python object in
+        # normalized data, thus data is translated as copy, to translate every occurrence once
+        return self._translator.translate_copy(normalized_data, language, verbose=verbose)
+
+    def get_inputs(self, container_name, language=None):
+        return self._translator.get_inputs(language)
 
     @cachedproperty
     def _contname_filepath_map(self):
@@ -89,15 +117,37 @@ class MachoNetBase(BaseMiner):
     def _read_cached_entity_name(self, file_path):
         with open(file_path, 'rb') as cache_file:
             file_data = cache_file.read()
-        entity_name, _ = Unmarshaller(file_data).load()
+        entity_name, _ = self._unmarshal(file_data)
         return entity_name
 
     def _read_cached_entity_data(self, file_path):
         with open(file_path, 'rb') as cache_file:
             file_data = cache_file.read()
-        _, cached_entity = Unmarshaller(file_data).load()
+        stage_stats.add_bytes(read=len(file_data))
+        _, cached_entity = self._unmarshal(file_data, payload=self._inline_payload)
         return self._get_payload(cached_entity)
 
+    def _unmarshal(self, data, compressed=False, payload=False):
+        """Read marshal data, using settings of this miner. Only data with payload is normalized."""
+        unmarshaller = Unmarshaller(
+            data, compressed=compressed, verify_checksums=self._verify_checksums,
+            normalize=payload and self._normalize_on_read, stats=self._unmarshal_stats)
+        return unmarshaller.load()
+
+    def _report_unmarshal_stats(self):
+        """Pass amount of verified and skipped checksums to stage stats."""
+        for name in ('checksums_verified', 'checksums_skipped'):
+            amount = self._unmarshal_stats.get(name)
+            if amount:
+                stage_stats.add_count(name, amount)
+
+    def _print_unmarshal_stats(self):
+        stats = self._unmarshal_stats
+        if stats.get('checksums_verified'):
+            print(u'    checksums: {} verified in {:.3f}s'.format(stats['checksums_verified'], stats['checksum_time']))
+        if stats.get('checksums_skipped'):
+            print(u'    checksums: {} skipped'.format(stats['checksums_skipped']))
+
     def _get_cache_dir(self):
         machonet_path = os.path.join(self._path_cache, 'MachoNet')
         server_path = self._get_server_directory(machonet_path)
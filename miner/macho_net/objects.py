@@ -1,7 +1,5 @@
-import zlib
-
 from .base import MachoNetBase
-from .unmarshal import MarshalError, Unmarshaller
+from .unmarshal import MarshalError
 
 
 class MachoNetObjectsMiner(MachoNetBase):
@@ -9,6 +7,7 @@ class MachoNetObjectsMiner(MachoNetBase):
 
     name = 'mn_cached_objects'
     _cache_dir = 'CachedObjects'
+    _inline_payload = False
 
     def _get_container_name(self, entity_name):
         # Name can be pretty much anything, so format it about as it is
@@ -29,10 +28,6 @@ class MachoNetObjectsMiner(MachoNetBase):
             raise MarshalError('cached object has data in unexpected format')
         if not is_compressed:
             return payload
-        try:
-            payload = zlib.decompress(payload)
-        except (KeyboardInterrupt, SystemExit):
-            raise
-        except Exception as e:
-            raise MarshalError('unable to decompress cached object: {}'.format(e))
-        return Unmarshaller(payload).load()
+        # Payload is decompressed piece by piece while it's being read, to avoid keeping the whole
+        # decompressed copy of it in memory
+        return self._unmarshal(payload, compressed=True, payload=True)
@@ -5,6 +5,8 @@ Format is reimplemented after Marshal.cpp from the blue library
 
 import struct
 import zlib
+import sys
+from time import time
 
 from .dbrow import RowDescriptor
 from .exception import MarshalError, UnsupportedTypeError
@@ -21,6 +23,13 @@ I32 = struct.Struct('<i')
 I64 = struct.Struct('<q')
 F64 = struct.Struct('<d')
 
+# Amount of compressed data fed to, and of decompressed data requested from zlib at once
+INFLATE_CHUNK_SIZE = 256 * 1024
+# Compressed data up to this size is inflated at once, as it takes just a single feed anyway
+INFLATE_AT_ONCE_SIZE = INFLATE_CHUNK_SIZE
+
+ROW_DESCRIPTOR_GUID = 'blue.DBRowDescriptor'
+
 
 class Type(object):
     """Type tags, as defined in the blue's marshal source."""
@@ -78,17 +87,59 @@ class Unmarshaller(object):
     to the type tag which precedes it.
     """
 
-    def __init__(self, data):
+    # Marshal data can be read from a window of passed data, which allows to read embedded streams
+    # without copying them out. When data is compressed, it is decompressed as reading goes. When
+    # normalization is requested, data is returned in the form EveNormalizer would convert it to
+    def __init__(self, data, offset=0, size=None, compressed=False, verify_checksums=True, normalize=False, stats=None):
         self._data = data
+        self._offset = offset
+        self._size = size
+        self._compressed = compressed
+        self._verify_checksums = verify_checksums
+        self._normalize = normalize
+        self._reader_map = self._normalizing_readers if normalize else self._readers
+        # Format: {stat name: value}, embedded streams report into the same map
+        self.stats = stats if stats is not None else {}
         self._stream = None
+        # Descriptors built out of marshalled ones, every one is built once
+        # Format: {id(marshalled descriptor): (marshalled descriptor, descriptor)}
+        self._row_descriptors = {}
+        # Amount of marshalled descriptors read in normalizing mode, less ones used by rows
+        self._loose_descriptors = 0
+        # Indices of shared objects whose iterators are being read, and of ones which were
+        # referred to meanwhile
+        self._building = set()
+        self._back_referenced = set()
 
     def load(self):
         """Entry point for reading jobs. Returns the single object passed data carries."""
         # Stream is set up here rather than on instantiation, so that the same data can be read
         # more than once
-        self._stream = Stream(self._data)
+        self._stream = self._open_stream()
+        self._row_descriptors = {}
+        self._loose_descriptors = 0
+        self._building = set()
+        self._back_referenced = set()
         self._read_header()
-        return self._route_object()
+        if self._normalize:
+            self._increment_stats('normalized_streams', 1)
+        obj = self._route_object()
+        self._stream.finish()
+        # Descriptors which are not used by rows are left for normalizer
+        if self._loose_descriptors:
+            self._increment_stats('unresolved_objects', self._loose_descriptors)
+        return obj
+
+    def _open_stream(self):
+        if self._compressed and len(self._data) <= INFLATE_AT_ONCE_SIZE:
+            try:
+                return Stream(zlib.decompress(self._data))
+            except zlib.error as e:
+                raise MarshalError('unable to decompress data: {}'.format(e))
+        if self._compressed:
+            return ZlibStream(self._data)
+        end = None if self._size is None else self._offset + self._size
+        return Stream(self._data, start=self._offset, end=end)
 
     def _route_object(self):
         """Pick proper method for the object stream is at, and invoke it."""
@@ -97,7 +148,7 @@ class Unmarshaller(object):
         # Objects referred to more than once are flagged, so that they are registered when read
         is_shared = bool(tag & SHARED_FLAG)
         try:
-            method = self._readers[type_id]
+            method = self._reader_map[type_id]
         except KeyError:
             raise UnsupportedTypeError('unsupported marshal type {} at offset {}'.format(type_id, self._stream.pos - 1))
         return method(self, is_shared)
@@ -115,10 +166,7 @@ class Unmarshaller(object):
         if map_count:
             # Mapping table sits at the very end of the data, and is not part of the body
             table_size = map_count * U32.size
-            if table_size > stream.end - stream.pos:
-                raise MarshalError('shared object table does not fit into the stream')
-            stream.end -= table_size
-            table = stream.data[stream.end:stream.end + table_size]
+            table = stream.read_tail(table_size)
             stream.mapping = [I32.unpack(table[i:i + 4])[0] for i in range(0, table_size, 4)]
             for number in stream.mapping:
                 if not 1 <= number <= map_count:
@@ -280,7 +328,7 @@ class Unmarshaller(object):
         index = self._stream.mark_shared(None) if is_shared else None
         guid = self._route_object()
         state = self._route_object()
-        obj = MarshalObject(guid, state=state)
+        obj = self._construct(MarshalObject(guid, state=state))
         if index is not None:
             self._stream.update_shared(index, obj)
         return obj
@@ -290,10 +338,7 @@ class Unmarshaller(object):
         contents = self._route_object()
         state = contents[2] if len(contents) > 2 else None
         obj = MarshalObject(self._guid_of(contents[0]), state=state, args=contents[1])
-        if index is not None:
-            self._stream.update_shared(index, obj)
-        self._read_iterators(obj)
-        return obj
+        return self._read_object_rest(obj, index)
 
     def _read_newobj(self, is_shared):
         index = self._stream.mark_shared(None) if is_shared else None
@@ -301,10 +346,27 @@ class Unmarshaller(object):
         args = contents[0]
         state = contents[1] if len(contents) > 1 else None
         obj = MarshalObject(self._guid_of(args[0]), state=state, args=tuple(args[1:]))
-        if index is not None:
-            self._stream.update_shared(index, obj)
+        return self._read_object_rest(obj, index)
+
+    def _read_object_rest(self, obj, index):
+        """Read iterators of reduced object, and construct it."""
+        if index is None:
+            self._read_iterators(obj)
+            return self._construct(obj)
+        # Iterators can refer to the object itself, thus it is registered before they are read
+        self._stream.update_shared(index, obj)
+        if not self._normalize:
+            self._read_iterators(obj)
+            return obj
+        self._building.add(index)
         self._read_iterators(obj)
-        return obj
+        self._building.discard(index)
+        # Objects referred to from their own iterators can't be replaced by constructed ones
+        if index in self._back_referenced:
+            self._back_referenced.discard(index)
+            self._increment_stats('unresolved_objects', 1)
+            return obj
+        return self._construct(obj, index)
 
     def _read_iterators(self, obj):
         items = []
@@ -330,7 +392,15 @@ class Unmarshaller(object):
         return reference
 
     def _read_dbrow(self, is_shared):
-        descriptor = RowDescriptor.build_from_marshalled(self._route_object())
+        marshalled = self._route_object()
+        if self._normalize:
+            self._loose_descriptors -= 1
+        # Rows usually share descriptor, thus it is built once and reused by all of them
+        try:
+            descriptor = self._row_descriptors[id(marshalled)][1]
+        except KeyError:
+            descriptor = RowDescriptor.build_from_marshalled(marshalled)
+            self._row_descriptors[id(marshalled)] = (marshalled, descriptor)
         row = descriptor.unpack(self._stream.read(self._stream.read_length()))
         # Values of object columns are not packed, they follow the row one by one
         for name in descriptor.object_names:
@@ -341,19 +411,41 @@ class Unmarshaller(object):
 
     def _read_wstream(self, is_shared):
         """Marshal stream embedded into another one, as a length-prefixed blob."""
-        return Unmarshaller(self._stream.read(self._stream.read_length())).load()
+        size = self._stream.read_length()
+        data, offset = self._stream.window(size)
+        unmarshaller = Unmarshaller(
+            data, offset=offset, size=size, verify_checksums=self._verify_checksums,
+            normalize=self._normalize, stats=self.stats)
+        return unmarshaller.load()
 
     def _read_reference(self, is_shared):
         return self._stream.get_shared(self._stream.read_length())
 
+    def _read_reference_normalizing(self, is_shared):
+        number = self._stream.read_length()
+        obj = self._stream.get_shared(number)
+        if self._building and number - 1 in self._building:
+            self._back_referenced.add(number - 1)
+        elif isinstance(obj, MarshalObject) and obj.__guid__ == ROW_DESCRIPTOR_GUID:
+            self._loose_descriptors += 1
+        return obj
+
     def _read_crc_check(self, is_shared):
         declared = self._stream.unpack(I32)
-        # Checksum covers all the data past itself
-        actual = zlib.adler32(self._stream.data[self._stream.pos:])
-        if actual != declared:
-            raise MarshalError('bad checksum: stream declares {}, data checksums to {}'.format(declared, actual))
+        # Checksum covers all the data past itself. Data which is trusted can be read without
+        # verification, as it takes another full pass over the data
+        if not self._verify_checksums:
+            self._increment_stats('checksums_skipped', 1)
+            return self._route_object()
+        started = time()
+        self._stream.verify_rest(declared)
+        self._increment_stats('checksums_verified', 1)
+        self._increment_stats('checksum_time', time() - started)
         return self._route_object()
 
+    def _increment_stats(self, name, amount):
+        self.stats[name] = self.stats.get(name, 0) + amount
+
     def _read_mark(self, is_shared):
         raise MarshalError('marker token at offset {} is not expected here'.format(self._stream.pos - 1))
 
@@ -399,26 +491,144 @@ class Unmarshaller(object):
         Type.CRC_CHECK: _read_crc_check,
         Type.MARK: _read_mark}
 
+    ################################################################################################
+    # Normalization
+    ################################################################################################
+    def _construct(self, obj, index=None):
+        r"""
+        In normalizing mode, convert just read object into python built-in types, if we know how
+        to. Unknown objects are left as they are, and are counted to let caller know that data
+        still needs to be normalized. Row descriptors are used by rows, ones found outside of rows
+        are left for normalizer too:
+
+        >>> columns = '\x14\x01\x14\x02\x10\x04name\x04\x82\x00\x00\x00'
+        >>> descriptor = '#\x14\x01\x14\x02\x02\x14blue.DBRowDescriptor' + columns + '--'
+        >>> stats = {}
+        >>> Unmarshaller('~\x00\x00\x00\x00' + descriptor, normalize=True, stats=stats).load().__guid__
+        'blue.DBRowDescriptor'
+        >>> stats['unresolved_objects']
+        1
+        """
+        if not self._normalize:
+            return obj
+        try:
+            hook = self._construction_hooks[obj.__guid__]
+        except (KeyError, TypeError):
+            # Descriptors are built by rows which use them, and are accounted when data is read
+            if obj.__guid__ == ROW_DESCRIPTOR_GUID:
+                self._loose_descriptors += 1
+            else:
+                self._increment_stats('unresolved_objects', 1)
+            return obj
+        constructed = hook(self, obj)
+        if index is not None:
+            self._stream.update_shared(index, constructed)
+        return constructed
+
+    def _construct_set(self, obj):
+        return tuple(obj.args[0])
+
+    def _construct_keyval(self, obj):
+        return obj.state
+
+    def _construct_rowset(self, obj):
+        header = obj.state['header']
+        return tuple(dict(zip(header, line)) for line in obj.state['lines'])
+
+    def _construct_carbon_rowset(self, obj):
+        return tuple(obj.list_items)
+
+    def _construct_carbon_indexed_rowset(self, obj):
+        return obj.dict_items
+
+    # Should be kept in sync with marshal object handlers of EveNormalizer
+    _construction_hooks = {
+        '__builtin__.set': _construct_set,
+        'utillib.KeyVal': _construct_keyval,
+        'eve.common.script.sys.rowset.Rowset': _construct_rowset,
+        'carbon.common.script.sys.crowset.CRowset': _construct_carbon_rowset,
+        'carbon.common.script.sys.crowset.CIndexedRowset': _construct_carbon_indexed_rowset}
+
+    def _decoding(reader):
+        """Make version of string reader which returns text, decoded the way EveNormalizer does."""
+        def read_decoded(self, is_shared):
+            return reader(self, is_shared).decode('cp1252')
+        return read_decoded
+
+    def _read_buffer_decoded(self, is_shared):
+        data = self._stream.read(self._stream.read_length()).decode('cp1252')
+        if is_shared:
+            self._stream.mark_shared(data)
+        return data
+
+    def _read_list_as_tuple(self, is_shared):
+        return self._read_sequence(is_shared, self._stream.read_length(), tuple)
+
+    _normalizing_readers = dict(_readers)
+    _normalizing_readers.update({
+        Type.STR: _decoding(_read_str),
+        Type.STR_EMPTY: _decoding(_read_str_empty),
+        Type.STR_CHAR: _decoding(_read_str_char),
+        Type.STR_SHORT: _decoding(_read_str_short),
+        Type.STR_TABLE: _decoding(_read_str_table),
+        Type.BUFFER: _read_buffer_decoded,
+        Type.LIST: _read_list_as_tuple,
+        Type.LIST0: _read_tuple0,
+        Type.LIST1: _read_tuple1,
+        Type.REFERENCE: _read_reference_normalizing})
+
+    del _decoding
+
 
 class Stream(object):
     """Cursor over marshal data"""
 
-    def __init__(self, data):
+    def __init__(self, data, start=0, end=None):
         self.data = data
-        self.pos = 0
-        self.end = len(data)
+        self.pos = start
+        # Limit is where data of the stream actually ends, end is where its body ends
+        self.limit = len(data) if end is None else end
+        if not 0 <= start <= self.limit <= len(data):
+            raise MarshalError('stream window {}:{} is outside of data ({})'.format(start, self.limit, len(data)))
+        self.end = self.limit
         self.shared = []
         self.mapping = []
         self.shared_used = 0
 
     def read(self, size):
+        self._check_read(size)
         end = self.pos + size
-        if size < 0 or end > self.end:
-            raise MarshalError('read of {} bytes at offset {} runs past end of stream ({})'.format(size, self.pos, self.end))
         chunk = self.data[self.pos:end]
         self.pos = end
         return chunk
 
+    def window(self, size):
+        """Skip data of passed size, and return (data, offset) to read it in place."""
+        self._check_read(size)
+        offset = self.pos
+        self.pos += size
+        return self.data, offset
+
+    def read_tail(self, size):
+        """Detach data of passed size from the end of the body, and return it."""
+        if size > self.end - self.pos:
+            raise MarshalError('shared object table does not fit into the stream')
+        self.end -= size
+        return self.data[self.end:self.end + size]
+
+    def verify_rest(self, declared):
+        """Check Adler-32 of all the data past current position, including the tail."""
+        # Buffer is a view into the data, thus nothing is copied
+        actual = zlib.adler32(buffer(self.data, self.pos, self.limit - self.pos))
+        _check_checksum(declared, actual)
+
+    def finish(self):
+        """Called when the object is read; plain data has nothing left to check."""
+
+    def _check_read(self, size):
+        if size < 0 or self.pos + size > self.end:
+            raise MarshalError('read of {} bytes at offset {} runs past end of stream ({})'.format(size, self.pos, self.end))
+
     def unpack(self, unpacker):
         return unpacker.unpack(self.read(unpacker.size))[0]
 
@@ -456,6 +666,120 @@ class Stream(object):
         return obj
 
 
+class ZlibStream(Stream):
+    """
+    Cursor over zlib-compressed marshal data. Only the part of data which is being read is kept
+    decompressed, and data is inflated once; size of data becomes known only when it is over.
+    Exception is data with shared objects, whose table has to be taken off the end of data before
+    the body is read - it takes an extra pass.
+    """
+
+    def __init__(self, compressed):
+        self._compressed = compressed
+        # Decompressed data is never held as a whole, thus base class is given none
+        Stream.__init__(self, '')
+        self.limit = self.end = sys.maxsize
+        self._inflater = self._inflate_iter(compressed)
+        # Decompressed data currently kept in memory, and position of its first byte
+        self._buffer = ''
+        self._buffer_pos = 0
+        # Checksums declared by data, with checksums of data inflated since they were declared
+        # Format: [[declared checksum, actual checksum]]
+        self._checksums = []
+
+    def read(self, size):
+        self._check_read(size)
+        self._fill(self.pos + size)
+        start = self.pos - self._buffer_pos
+        chunk = self._buffer[start:start + size]
+        self.pos += size
+        return chunk
+
+    def peek_tag(self):
+        if self.pos >= self.end:
+            raise MarshalError('expected a type tag at offset {}, but stream ended'.format(self.pos))
+        self._fill(self.pos + 1)
+        return ord(self._buffer[self.pos - self._buffer_pos])
+
+    def window(self, size):
+        # Embedded data is not compressed separately, thus it has to be taken out of the buffer
+        return self.read(size), 0
+
+    def read_tail(self, size):
+        size_total = 0
+        tail = ''
+        for chunk in self._inflate_iter(self._compressed):
+            size_total += len(chunk)
+            tail = (tail + chunk)[-size:]
+        if size > size_total - self.pos:
+            raise MarshalError('shared object table does not fit into the stream')
+        self.limit = size_total
+        self.end = size_total - size
+        return tail
+
+    def verify_rest(self, declared):
+        # Checksum is composed as the rest of data is inflated, and is checked once it is over
+        self._checksums.append([declared, zlib.adler32(self._buffer[self.pos - self._buffer_pos:])])
+
+    def finish(self):
+        """Inflate what is left of data, which makes sure it is complete, and check its checksum."""
+        for chunk in self._inflater:
+            self._consume(chunk)
+        for declared, actual in self._checksums:
+            _check_checksum(declared, actual)
+
+    def _fill(self, end):
+        """Make sure buffer holds data up to passed position, dropping data which was read."""
+        if end <= self._buffer_pos + len(self._buffer):
+            return
+        parts = [self._buffer[self.pos - self._buffer_pos:]]
+        size = len(parts[0])
+        self._buffer_pos = self.pos
+        try:
+            while self._buffer_pos + size < end:
+                chunk = next(self._inflater)
+                self._consume(chunk)
+                parts.append(chunk)
+                size += len(chunk)
+        except StopIteration:
+            raise MarshalError('compressed data ended at offset {}, before {}'.format(self._buffer_pos + size, end))
+        self._buffer = ''.join(parts)
+
+    def _consume(self, chunk):
+        """Account freshly inflated chunk of data."""
+        for checksum in self._checksums:
+            checksum[1] = zlib.adler32(chunk, checksum[1])
+
+    def _inflate_iter(self, compressed):
+        decompressor = zlib.decompressobj()
+        try:
+            for in_pos in xrange(0, len(compressed), INFLATE_CHUNK_SIZE):
+                data = buffer(compressed, in_pos, INFLATE_CHUNK_SIZE)
+                while data:
+                    chunk = decompressor.decompress(data, INFLATE_CHUNK_SIZE)
+                    if chunk:
+                        yield chunk
+                    data = decompressor.unconsumed_tail
+            # Once compressed stream is over, decompressor leaves whatever is fed to it unused;
+            # if it consumes a byte past data, data is truncated
+            if not decompressor.unused_data:
+                chunk = decompressor.decompress('\0')
+                if not decompressor.unused_data:
+                    raise MarshalError('compressed data is truncated')
+                if chunk:
+                    yield chunk
+            chunk = decompressor.flush()
+        except zlib.error as e:
+            raise MarshalError('unable to decompress data: {}'.format(e))
+        if chunk:
+            yield chunk
+
+
+def _check_checksum(declared, actual):
+    if actual != declared:
+        raise MarshalError('bad checksum: stream declares {}, data checksums to {}'.format(declared, actual))
+
+
 class GlobalReference(object):
     """Stand-in for a client class referred to by name."""
 
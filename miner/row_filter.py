@@ -0,0 +1,51 @@
+class RowFilter(object):
+    """
+    Conditions rows of a container have to satisfy to be fetched. Row passes
+    if its key is any of requested keys or is within any of requested key
+    ranges (when those are specified), and if it satisfies all predicates.
+    """
+
+    operators = ('=', '!=', '<>', '<', '<=', '>', '>=')
+
+    def __init__(self, keys=(), key_ranges=(), predicates=()):
+        self.keys = tuple(keys)
+        # Format: ((lowest key, highest key), ...), both ends included
+        self.key_ranges = tuple(key_ranges)
+        # Format: ((column name, operator, value), ...)
+        self.predicates = tuple(predicates)
+
+    def get_sql(self, key_column, columns):
+        """
+        Compose condition for SQL where clause. Returns condition and
+        its parameters.
+        """
+        clauses = []
+        params = []
+        key_clauses = []
+        if self.keys or self.key_ranges:
+            if key_column is None:
+                raise RowFilterError('container cannot be filtered by keys, as it has no key column')
+        if self.keys:
+            key_clauses.append(u'{} in ({})'.format(self._quote(key_column), u', '.join(u'?' * len(self.keys))))
+            params.extend(self.keys)
+        for low, high in self.key_ranges:
+            key_clauses.append(u'{} between ? and ?'.format(self._quote(key_column)))
+            params.extend((low, high))
+        if key_clauses:
+            clauses.append(u'({})'.format(u' or '.join(key_clauses)))
+        for column, operator, value in self.predicates:
+            # Column names cannot be passed as parameters, thus accept only names we know
+            if column not in columns:
+                raise RowFilterError(u'container has no column "{}"'.format(column))
+            if operator not in self.operators:
+                raise RowFilterError(u'unknown operator "{}"'.format(operator))
+            clauses.append(u'{} {} ?'.format(self._quote(column), operator))
+            params.append(value)
+        return u' and '.join(clauses), params
+
+    def _quote(self, identifier):
+        return u'"{}"'.format(identifier.replace(u'"', u'""'))
+
+
+class RowFilterError(Exception):
+    """Raised when row filter cannot be applied to a container."""
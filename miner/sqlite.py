@@ -1,6 +1,4 @@
-import sqlite3
-
-from util import cachedproperty
+from util import SqlitePool, cachedproperty
 from .base import BaseMiner, DiscoveredData, DiscoveryError
 
 
@@ -8,11 +6,15 @@ class SqliteMiner(BaseMiner):
     """Extract data from SQLite databases bundled with client."""
 
     name = 'sqlite'
+    supports_row_filter = True
+    uses_translator = True
+    translatable_after_fetch = True
 
-    def __init__(self, resbrowser, translator):
+    def __init__(self, resbrowser, translator, dbpool=None):
         # Format: {db alias: db path}
         self._resbrowser = resbrowser
         self._translator = translator
+        self._dbpool = dbpool if dbpool is not None else SqlitePool()
 
     def discovery_error_iter(self):
         for discovery_error in self._contname_dbtable_map.errors:
@@ -22,22 +24,57 @@ class SqliteMiner(BaseMiner):
         for container_name in sorted(self._contname_dbtable_map.data):
             yield container_name
 
-    def get_data(self, container_name, language=None, verbose=False, **kwargs):
+    def get_data(self, container_name, language=None, verbose=False, row_filter=None, **kwargs):
+        rows = []
+        for chunk in self.get_data_chunks(container_name, language=language, verbose=verbose, row_filter=row_filter):
+            rows.extend(chunk)
+        return rows
+
+    def get_data_chunks(self, container_name, language=None, verbose=False, chunk_size=1000, row_filter=None, **kwargs):
         try:
             dbpath, table_name = self._contname_dbtable_map.data[container_name]
         except KeyError:
             self._container_not_found(container_name)
         else:
-            rows = []
-            with sqlite3.connect(dbpath) as dbconn:
-                c = dbconn.cursor()
-                c.execute(u'select * from {}'.format(table_name))
-                headers = list(map(lambda x: x[0], c.description))
-                for sqlite_row in c:
-                    row = dict(zip(headers, sqlite_row))
-                    rows.append(row)
-            self._translator.translate_container(rows, language, verbose=verbose)
-            return rows
+            return self._row_chunk_iter(dbpath, table_name, language, verbose, chunk_size, row_filter)
+
+    def get_inputs(self, container_name, language=None):
+        inputs = self._translator.get_inputs(language)
+        try:
+            dbpath, _ = self._contname_dbtable_map.data[container_name]
+        except KeyError:
+            return inputs
+        # Tables of the same database share connection to it
+        inputs.append(('database', dbpath))
+        return inputs
+
+    def _row_chunk_iter(self, dbpath, table_name, language, verbose, chunk_size, row_filter):
+        """Fetch rows from the table few at a time, and translate them before handing over."""
+        stats = {}
+        dbconn = self._dbpool.get(dbpath)
+        query = u'select * from {}'.format(table_name)
+        params = []
+        # Filter is applied by SQLite, to avoid reading rows we do not need
+        if row_filter is not None:
+            key_column, column_names = self.__get_table_layout(dbconn, table_name)
+            condition, params = row_filter.get_sql(key_column, column_names)
+            if condition:
+                query = u'{} where {}'.format(query, condition)
+        c = dbconn.cursor()
+        try:
+            c.execute(query, params)
+            headers = list(map(lambda x: x[0], c.description))
+            while True:
+                sqlite_rows = c.fetchmany(chunk_size)
+                if not sqlite_rows:
+                    break
+                rows = [dict(zip(headers, sqlite_row)) for sqlite_row in sqlite_rows]
+                self._translator.translate_container(rows, language, stats=stats)
+                yield rows
+        finally:
+            c.close()
+        if verbose and language:
+            self._translator.print_stats(stats)
 
     @cachedproperty
     def _contname_dbtable_map(self):
@@ -65,8 +102,23 @@ class SqliteMiner(BaseMiner):
                 contname_dbtable_map.data[container_name] = (resource_info.file_abspath, table_name)
         return contname_dbtable_map
 
+    def __get_table_layout(self, dbconn, table_name):
+        """Return name of single-column primary key (None if there is none), and names of all columns."""
+        c = dbconn.cursor()
+        try:
+            c.execute(u'pragma table_info({})'.format(table_name))
+            table_info = c.fetchall()
+        finally:
+            c.close()
+        column_names = [row[1] for row in table_info]
+        key_names = [row[1] for row in table_info if row[5]]
+        key_column = key_names[0] if len(key_names) == 1 else None
+        return key_column, column_names
+
     def __get_table_names(self, file_path):
-        with sqlite3.connect(file_path) as dbconn:
-            c = dbconn.cursor()
+        c = self._dbpool.get(file_path).cursor()
+        try:
             c.execute('select name from sqlite_master where type = \'table\'')
             return [row[0] for row in c]
+        finally:
+            c.close()
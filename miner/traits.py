@@ -18,6 +18,7 @@ class TraitMiner(BaseMiner):
     """
 
     name = 'phobos'
+    uses_translator = True
 
     def __init__(self, fsdlite_miner, fsdbuilt_miner, translator):
         self._fsdlite_miner = fsdlite_miner
@@ -33,6 +34,20 @@ class TraitMiner(BaseMiner):
     def contname_iter(self):
         yield self._container_name
 
+    def get_inputs(self, container_name, language=None):
+        inputs = [
+            ('container', self._fsdlite_miner.name, 'infobubbles'),
+            ('container', self._fsdbuilt_miner.name, 'types'),
+            ('container', self._fsdbuilt_miner.name, 'dogmaunits')]
+        inputs.extend(self._translator.get_inputs(language or self._fallback_lang))
+        return inputs
+
+    def release_caches(self):
+        released = BaseMiner.release_caches(self) or bool(self._type_name_map_all or self._unit_display_map_all)
+        self._type_name_map_all.clear()
+        self._unit_display_map_all.clear()
+        return released
+
     def get_data(self, container_name, language=None, **kwargs):
         if container_name != self._container_name:
             self._container_not_found(container_name)
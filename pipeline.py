@@ -0,0 +1,65 @@
+import Queue
+import sys
+import threading
+import traceback
+
+
+# Interval in seconds at which waiting main thread wakes up; waits without
+# timeout cannot be interrupted with Ctrl+C in python 2
+WAIT_INTERVAL = 0.5
+
+
+class WritePipeline(object):
+    """
+    Runs jobs in separate thread in the order they are submitted, so that
+    writing of one container overlaps with fetching of the next one.
+
+    Amount of jobs waiting in queue is limited; once it is reached, job
+    submission blocks until writing thread catches up, which keeps amount
+    of data held in memory bounded.
+    """
+
+    def __init__(self, queue_size):
+        self._queue = Queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name='writer')
+        # Thread does not keep process alive if main thread dies
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, function, *args):
+        """Queue function call, waiting while queue is full."""
+        self.__put((function, args))
+
+    def close(self):
+        """Wait until all submitted jobs are done, and stop the thread."""
+        if not self._thread.is_alive():
+            return
+        self.__put(None)
+        while self._thread.is_alive():
+            self._thread.join(WAIT_INTERVAL)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            function, args = job
+            # Jobs report their failures themselves, anything else must not stop writing of the rest
+            try:
+                function(*args)
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+
+    def __put(self, job):
+        while True:
+            try:
+                self._queue.put(job, timeout=WAIT_INTERVAL)
+            except Queue.Full:
+                continue
+            return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,11 +1,12 @@
 #!/usr/bin/env python
 
+import os.path
 import sys
 
 from flow import FlowManager
 from miner import *
 from writer import *
-from util import ResourceBrowser, Translator
+from util import ContainerProfiler, ResourceBrowser, SqlitePool, Translator, stage_stats
 
 
 SERVER_INFO = {
@@ -14,21 +15,34 @@ SERVER_INFO = {
     'thunderdome': '87.237.38.16',
     'serenity': '42.186.79.5'}
 
+LANGUAGES = ('de', 'en-us', 'es', 'fr', 'it', 'ja', 'ru', 'zh', 'multi')
 
-def run(path_eve, server_alias, path_cache, filter_string, language, path_json, group=None):
+
+def run(path_eve, server_alias, path_cache, filter_string, language, path_json, group=None, chunk_size=None, workers=1,
+        progress=False, stats_report=None, profile_dir=None, profile_top=10, memory_budget=None, languages=None,
+        path_binary=None, path_sqlite=None, path_columnar=None, compression=None, compression_level=None,
+        compression_threads=0, fsync='never', manifest=False, path_previous=None, write_queue_size=None, shard=None,
+        trust_cache=False, normalize_on_read=False):
     resource_browser = ResourceBrowser(eve_path=path_eve, server_alias=server_alias)
+    # Connections to client databases are shared by all miners, and are kept open through the run
+    dbpool = SqlitePool()
 
     pickle_miner = PickleMiner(resbrowser=resource_browser)
     trans = Translator(pickle_miner=pickle_miner)
     fsdbinary_miner = FsdBinaryMiner(resbrowser=resource_browser, translator=trans)
     fsdbuilt_miner = FsdBuiltMiner(resbrowser=resource_browser, translator=trans)
-    fsdlite_miner = FsdLiteMiner(resbrowser=resource_browser, translator=trans)
+    fsdlite_miner = FsdLiteMiner(resbrowser=resource_browser, translator=trans, dbpool=dbpool, workers=workers)
     metadata_miner = MetadataMiner(resbrowser=resource_browser)
-    sqlite_miner = SqliteMiner(resbrowser=resource_browser, translator=trans)
+    sqlite_miner = SqliteMiner(resbrowser=resource_browser, translator=trans, dbpool=dbpool)
     trait_miner = TraitMiner(fsdlite_miner=fsdlite_miner, fsdbuilt_miner=fsdbuilt_miner, translator=trans)
     server_ip = SERVER_INFO[server_alias]
-    mn_call_miner = MachoNetCallsMiner(path_cache=path_cache, server_ip=server_ip, translator=trans)
-    mn_object_miner = MachoNetObjectsMiner(path_cache=path_cache, server_ip=server_ip, translator=trans)
+    # Checksums of cached data are not verified when cache is trusted
+    mn_call_miner = MachoNetCallsMiner(
+        path_cache=path_cache, server_ip=server_ip, translator=trans, verify_checksums=not trust_cache,
+        normalize_on_read=normalize_on_read)
+    mn_object_miner = MachoNetObjectsMiner(
+        path_cache=path_cache, server_ip=server_ip, translator=trans, verify_checksums=not trust_cache,
+        normalize_on_read=normalize_on_read)
 
     miners = [
         metadata_miner,
@@ -41,10 +55,50 @@ def run(path_eve, server_alias, path_cache, filter_string, language, path_json,
         mn_call_miner,
         mn_object_miner]
 
-    writers = [
-        JsonWriter(path_json, indent=2, group=group)]
-
-    FlowManager(miners, writers).run(filter_string=filter_string, language=language)
+    def get_writers(*subdirectories):
+        directory = os.path.join(path_json, *subdirectories)
+        json_manifest = None
+        if manifest:
+            json_manifest = Manifest(
+                directory, previous_directory=os.path.join(path_previous, *subdirectories) if path_previous else None)
+        writers = [JsonWriter(
+            directory, indent=2, group=group, compression=compression, compression_level=compression_level,
+            compression_threads=compression_threads, fsync=fsync, manifest=json_manifest, shard=shard)]
+        if path_binary:
+            writers.append(BinaryWriter(os.path.join(path_binary, *subdirectories), fsync=fsync))
+        if path_columnar:
+            writers.append(ColumnarWriter(os.path.join(path_columnar, *subdirectories), fsync=fsync))
+        if path_sqlite:
+            # Database of every language is placed next to the requested one, e.g. phobos.de.db
+            root, ext = os.path.splitext(path_sqlite)
+            writers.append(SqliteWriter(u''.join([root] + [u'.' + s for s in subdirectories] + [ext])))
+        return writers
+
+    # Several languages are dumped in one pass, each into its own directory,
+    # and nothing is written into root one then
+    language_writers = None
+    if languages:
+        writers = []
+        language_writers = dict((l, get_writers(l)) for l in languages)
+    else:
+        writers = get_writers()
+
+    profiler = ContainerProfiler(profile_dir, top=profile_top) if profile_dir else None
+
+    stage_stats.reset()
+    try:
+        with dbpool:
+            FlowManager(
+                miners, writers, chunk_size=chunk_size, progress=progress, profiler=profiler,
+                memory_budget=memory_budget, caches=(trans,),
+                releasers={'language': trans.release_language, 'database': dbpool.release},
+                translator=trans, language_writers=language_writers,
+                write_queue_size=write_queue_size).run(filter_string=filter_string, language=language)
+    finally:
+        for writer in writers + sum((language_writers or {}).values(), []):
+            writer.close()
+    if stats_report:
+        stage_stats.write_report(stats_report)
 
 
 if __name__ == '__main__':
@@ -60,7 +114,20 @@ if __name__ == '__main__':
         sys.exit()
 
     import argparse
-    import os.path
+
+    def language_list(value):
+        languages = [l.strip() for l in value.split(',') if l.strip()]
+        for language in languages:
+            if language not in LANGUAGES:
+                msg = 'invalid choice: {!r} (choose from {})'.format(language, ', '.join(repr(l) for l in LANGUAGES))
+                raise argparse.ArgumentTypeError(msg)
+        return languages
+
+    def shard_spec(value):
+        mode, _, size = value.partition(':')
+        if mode not in ('range', 'hash') or not size.isdigit() or not int(size):
+            raise argparse.ArgumentTypeError('invalid sharding: {!r} (use range:<size> or hash:<count>)'.format(value))
+        return mode, int(size)
 
     parser = argparse.ArgumentParser(description='This script extracts data from EVE client and writes it into JSON files')
     parser.add_argument('-e', '--eve', required=True,
@@ -72,19 +139,88 @@ if __name__ == '__main__':
                         choices=('tq', 'sisi', 'thunderdome', 'serenity'))
     parser.add_argument('-j', '--json', required=True,
                         help='Output directory for the JSON files')
-    parser.add_argument('-t', '--translate', default=None,
-                        help='Attempt to translate strings into specified language. Default is no translation',
-                        choices=('de', 'en-us', 'es', 'fr', 'it', 'ja', 'ru', 'zh', 'multi'))
+    parser.add_argument('-t', '--translate', type=language_list, default=[],
+                        help='Attempt to translate strings into specified language. Several comma-separated languages '
+                             'can be specified, then data is written into subdirectory per language. Choices are {}. '
+                             'Default is no translation'.format(', '.join(LANGUAGES)))
     parser.add_argument('-l', '--list', default='',
                         help='Comma-separated list of container names to extract. If not specified, extracts everything')
     parser.add_argument('-g', '--group', type=int, default=None,
                         help='Split output into several files, containing this amount of top-level entities at most')
+    parser.add_argument('--shard', type=shard_spec, default=None,
+                        help='Split maps into files by their keys, either by ranges of integer keys, e.g. range:1000, '
+                             'or into given amount of files by hash of keys, e.g. hash:16. Every sharded container '
+                             'gets index file, which lists its shards')
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help='Stream rows of database tables to output in chunks of this size, instead of loading whole tables')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Amount of processes to decode big containers with. Default is 1')
+    parser.add_argument('--progress', action='store_true',
+                        help='Print time spent on every processing stage after each container')
+    parser.add_argument('--stats-report', default=None,
+                        help='Write time, memory and I/O stats of every container and stage into this file, CSV if it has .csv extension, JSON otherwise')
+    parser.add_argument('--profile', default=None,
+                        help='Profile processing of every container, and store profiles into this directory as .pstats files')
+    parser.add_argument('--profile-top', type=int, default=10,
+                        help='Amount of the most time-consuming functions to print for every profiled container. Default is 10')
+    parser.add_argument('--memory-budget', type=int, default=None,
+                        help='Amount of memory in megabytes; when the script occupies more, it drops cached data')
+    parser.add_argument('-b', '--binary', default=None,
+                        help='Output directory for indexed binary files, which are written in addition to JSON files')
+    parser.add_argument('--sqlite', default=None,
+                        help='Path to SQLite database, into which data is written in addition to JSON files, table per container')
+    parser.add_argument('--columnar', default=None,
+                        help='Output directory for containers which are tables, written in addition to JSON files as NumPy file per column')
+    parser.add_argument('-z', '--compress', default=None, choices=('gzip', 'zstd'),
+                        help='Compress JSON files while writing them. zstd requires zstandard package')
+    parser.add_argument('--compress-level', type=int, default=None,
+                        help='Compression level. Default is 9 for gzip and 3 for zstd')
+    parser.add_argument('--compress-threads', type=int, default=0,
+                        help='Amount of threads to compress with, -1 uses all CPU cores. Supported by zstd only')
+    parser.add_argument('--fsync', default='never', choices=('never', 'file', 'directory'),
+                        help='When to flush written files to storage device: never, after every file, or after every file '
+                             'and its directory. Default is never')
+    parser.add_argument('-m', '--manifest', action='store_true',
+                        help='Write manifest with hashes of JSON files, and leave files whose contents did not change untouched')
+    parser.add_argument('--previous', default=None,
+                        help='Directory with JSON files of previous dump; unchanged files are hard-linked from there. '
+                             'Implies --manifest')
+    parser.add_argument('--write-queue', type=int, default=None,
+                        help='Write data in separate thread while next container is fetched; at most this amount '
+                             'of containers or chunks waits to be written')
+    parser.add_argument('--trust-cache', action='store_true',
+                        help='Do not verify checksums embedded into cached MachoNet data, which saves a pass over it')
+    parser.add_argument('--normalize-on-read', action='store_true',
+                        help='Convert cached MachoNet data into python types while it is unmarshalled, instead of '
+                             'doing it in separate pass')
     args = parser.parse_args()
+    if args.compress == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            parser.error('zstd compression requires zstandard package')
 
     # Expand home directory
     path_eve = os.path.expanduser(args.eve)
     path_cache = os.path.expanduser(args.cache)
     path_json = os.path.expanduser(args.json)
+    # Single language is dumped as usual, several - each into its own directory
+    language = args.translate[0] if len(args.translate) == 1 else None
+    languages = args.translate if len(args.translate) > 1 else None
+    stats_report = os.path.expanduser(args.stats_report) if args.stats_report else None
+    profile_dir = os.path.expanduser(args.profile) if args.profile else None
+    memory_budget = args.memory_budget * 1024 * 1024 if args.memory_budget else None
+    path_binary = os.path.expanduser(args.binary) if args.binary else None
+    path_sqlite = os.path.expanduser(args.sqlite) if args.sqlite else None
+    path_columnar = os.path.expanduser(args.columnar) if args.columnar else None
+    path_previous = os.path.expanduser(args.previous) if args.previous else None
 
     run(path_eve=path_eve, server_alias=args.server, path_cache=path_cache, filter_string=args.list,
-        language=args.translate, path_json=path_json, group=args.group)
+        language=language, path_json=path_json, group=args.group, chunk_size=args.chunk_size,
+        workers=args.workers, progress=args.progress, stats_report=stats_report,
+        profile_dir=profile_dir, profile_top=args.profile_top, memory_budget=memory_budget,
+        languages=languages, path_binary=path_binary, path_sqlite=path_sqlite, path_columnar=path_columnar,
+        compression=args.compress, compression_level=args.compress_level, compression_threads=args.compress_threads,
+        fsync=args.fsync, manifest=args.manifest or bool(path_previous), path_previous=path_previous,
+        write_queue_size=args.write_queue, shard=args.shard, trust_cache=args.trust_cache,
+        normalize_on_read=args.normalize_on_read)
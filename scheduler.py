@@ -0,0 +1,79 @@
+import heapq
+
+
+class Scheduler(object):
+    """
+    Orders containers so that every container goes after containers it
+    depends on, and releases inputs shared by containers as soon as the
+    last container which needs them is processed.
+
+    Inputs are tuples, whose first element is kind of input, e.g.
+    ('language', 'de') or ('container', 'fsd_built', 'types'). Inputs
+    of 'container' kind define order; inputs of kinds which have releaser
+    are released by calling it with the rest of the tuple.
+    """
+
+    def __init__(self, jobs, releasers=None):
+        # Format: [(miner, container name, [input])], in the order they'd be processed without dependencies
+        self._jobs = jobs
+        # Format: {input kind: function}
+        self._releasers = releasers or {}
+        # Format: {input: amount of jobs which need it and are not done yet}
+        self._consumer_counts = {}
+        for _, _, inputs in jobs:
+            for job_input in set(inputs):
+                self._consumer_counts[job_input] = self._consumer_counts.get(job_input, 0) + 1
+
+    def job_iter(self):
+        """
+        Iterate over (miner, container name) in the order they should be
+        processed. Inputs of the job are released when iteration moves past it.
+        """
+        for index in self._get_order():
+            miner, container_name, inputs = self._jobs[index]
+            yield miner, container_name
+            self._release(inputs)
+
+    def _get_order(self):
+        """
+        Sort jobs topologically, keeping the original order when dependencies
+        do not demand otherwise.
+        """
+        # Format: {(miner name, container name): job index}
+        indices = dict(((miner.name, container_name), i) for i, (miner, container_name, _) in enumerate(self._jobs))
+        # Format: {job index: [indices of jobs which depend on it]}
+        dependents = dict((i, []) for i in xrange(len(self._jobs)))
+        dependency_counts = [0] * len(self._jobs)
+        for i, (_, _, inputs) in enumerate(self._jobs):
+            for job_input in set(inputs):
+                if job_input[0] != 'container':
+                    continue
+                dependency = indices.get(job_input[1:])
+                # Dependencies which are not going to be processed do not affect order
+                if dependency is None or dependency == i:
+                    continue
+                dependents[dependency].append(i)
+                dependency_counts[i] += 1
+        ready = [i for i, count in enumerate(dependency_counts) if not count]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            index = heapq.heappop(ready)
+            order.append(index)
+            for dependent in dependents[index]:
+                dependency_counts[dependent] -= 1
+                if not dependency_counts[dependent]:
+                    heapq.heappush(ready, dependent)
+        # Jobs which depend on each other in a loop still have to be processed
+        scheduled = set(order)
+        order.extend(i for i in xrange(len(self._jobs)) if i not in scheduled)
+        return order
+
+    def _release(self, inputs):
+        for job_input in set(inputs):
+            self._consumer_counts[job_input] -= 1
+            if self._consumer_counts[job_input]:
+                continue
+            releaser = self._releasers.get(job_input[0])
+            if releaser is not None:
+                releaser(*job_input[1:])
@@ -1,4 +1,9 @@
 from .cached_property import cachedproperty
+# Other utilities report their stages, thus collector goes before them
+from .stage_stats import StageStats, stage_stats
 from .eve_normalize import EveNormalizer
+from .memory import get_current_rss
+from .profiler import ContainerProfiler
 from .resource_browser import ResourceBrowser
+from .sqlite_pool import SqlitePool
 from .translator import Translator
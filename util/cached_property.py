@@ -21,3 +21,7 @@ class cachedproperty(object):
         value = self.__method(instance)
         setattr(instance, self.__method.__name__, value)
         return value
+
+    def clear(self, instance):
+        """Forget value cached on passed instance, if any."""
+        instance.__dict__.pop(self.__method.__name__, None)
@@ -1,6 +1,9 @@
 import inspect
 import types
 from collections import OrderedDict
+from itertools import izip
+
+from util import stage_stats
 
 
 class EveNormalizer(object):
@@ -10,8 +13,14 @@ class EveNormalizer(object):
     python built-in types.
     """
 
-    def __init__(self):
+    def __init__(self, reuse_native=False):
+        # When set, dicts and tuples which do not need any conversion are
+        # returned as-is instead of being copied, thus result may share
+        # parts with passed container
+        self._reuse_native = reuse_native
         self._loader_module = None
+        # Format: {type: bound method}
+        self._dispatch = self._get_static_dispatch()
 
     def run(self, eve_container, loader_module=None):
         """
@@ -20,50 +29,79 @@ class EveNormalizer(object):
         data structures.
         """
         self._loader_module = loader_module
-        data = self._route_object(eve_container)
+        # Routing of some types depends on loader, thus forget everything learned so far
+        self._dispatch = self._get_static_dispatch()
+        with stage_stats.stage(u'normalization'):
+            data = self._route_object(eve_container)
         return data
 
     def _route_object(self, obj):
         """
         Pick proper method for passed object and invoke it.
         """
+        cls = type(obj)
         # Primitive objects do not need any conversion
-        if type(obj) in self._primitives:
+        if cls in self._primitives:
             return obj
-        # Try strict class/guid matching first
-        cls = type(obj)
         try:
-            method = self._class_match[cls]
+            method = self._dispatch[cls]
         except KeyError:
-            pass
+            method = self._resolve_method(obj)
+        return method(obj)
+
+    def _get_static_dispatch(self):
+        dispatch = {}
+        for cls, method in self._class_match.iteritems():
+            dispatch[cls] = method.__get__(self)
+        return dispatch
+
+    def _resolve_method(self, obj):
+        """
+        Find method for object whose type has not been seen yet, and remember it
+        for the type.
+        """
+        # Objects unpacked from marshal data carry guid on the instance, thus
+        # for those we can remember only that they are to be routed by guid
+        if '__guid__' in getattr(obj, '__dict__', ()):
+            method = self._route_by_guid
         else:
-            return method(self, obj)
+            method = self._find_method(obj)
+        self._dispatch[type(obj)] = method
+        return method
+
+    def _route_by_guid(self, obj):
+        try:
+            method = self._name_match[obj.__guid__]
+        except KeyError:
+            return self._find_method(obj)(obj)
+        return method(self, obj)
+
+    def _find_method(self, obj):
+        """
+        Go through all the routing rules to find method for passed object.
+        """
         # __guid__ is available for many objects exposed by the client,
         # use class name as fallback only when it's not available
         cls_name = getattr(obj, '__guid__', type(obj).__name__)
         try:
-            method = self._name_match[cls_name]
+            return self._name_match[cls_name].__get__(self)
         except KeyError:
             pass
-        else:
-            return method(self, obj)
         # Try to find parent class for passed object, and if we
         # have any in our records - run handler for it
         for candidate_cls in self._subclass_match:
             if isinstance(obj, candidate_cls):
-                method = self._subclass_match[candidate_cls]
-                return method(self, obj)
+                return self._subclass_match[candidate_cls].__get__(self)
         # Stuff specific to FSD binary format
         if self._loader_module is not None:
             # Check if class is defined in passed loader, if it is, then
             # we're dealing with FSD binary item for certain
             if inspect.getmodule(type(obj)) is self._loader_module:
-                return self.pythonize_fsdbuilt_item(obj)
+                return self.pythonize_fsdbuilt_item
             # FSD contains a bunch of vector classes which are defined outside of
             # loader (shown as defined in builtins), process them separately
             if type(obj).__name__.endswith('_vector'):
-                return self.pythonize_fsdbuilt_item(obj, ignore_attrs=(
-                    'n_fields', 'n_sequence_fields', 'n_unnamed_fields'))
+                return self._pythonize_fsdbuilt_vector
         # If we got here, routing failed
         msg = 'unable to route {}'.format(type(obj))
         guid = getattr(obj, '__guid__', None)
@@ -71,6 +109,65 @@ class EveNormalizer(object):
             msg = '{} (guid {})'.format(msg, guid)
         raise UnknownContainerTypeError(msg)
 
+    def _pythonize_nested(self, obj):
+        """
+        Convert python lists, tuples and dicts, nested into each other to any
+        depth. Nesting is walked using own stack instead of recursion, other
+        objects met on the way are routed as usual.
+        """
+        primitives = self._primitives
+        nested_types = self._nested_types
+        stack = []
+        frame = self._open_frame(obj)
+        while True:
+            items, keys, values = frame[0], frame[1], frame[2]
+            for value in items:
+                if keys is not None:
+                    key, value = value
+                    if type(key) not in primitives:
+                        proc_key = self._route_object(key)
+                        if proc_key is not key:
+                            frame[4] = True
+                        key = proc_key
+                    keys.append(key)
+                value_type = type(value)
+                if value_type in primitives:
+                    values.append(value)
+                elif value_type in nested_types:
+                    stack.append(frame)
+                    frame = self._open_frame(value)
+                    break
+                else:
+                    proc_value = self._route_object(value)
+                    if proc_value is not value:
+                        frame[4] = True
+                    values.append(proc_value)
+            else:
+                source = frame[3]
+                if self._reuse_native and not frame[4]:
+                    result = source
+                elif keys is None:
+                    result = tuple(values)
+                else:
+                    result = dict(izip(keys, values))
+                if not stack:
+                    return result
+                frame = stack.pop()
+                frame[2].append(result)
+                if result is not source:
+                    frame[4] = True
+
+    def _open_frame(self, obj):
+        """
+        Frame format: [iterator over contents, converted keys or None
+        for sequences, converted values, source container, flag which
+        tells if anything in the container had to be converted].
+        """
+        if type(obj) is types.DictType:
+            return [obj.iteritems(), [], [], obj, False]
+        # Lists are always converted, as they are exposed as tuples
+        return [iter(obj), None, [], obj, type(obj) is types.ListType]
+
     def _pythonize_iterable(self, obj):
         """
         For objects which have access interface similar to python
@@ -181,18 +278,28 @@ class EveNormalizer(object):
             item[attr_name] = self._route_object(getattr(obj, attr_name))
         return item
 
-    _primitives = (
+    def _pythonize_fsdbuilt_vector(self, obj):
+        return self.pythonize_fsdbuilt_item(obj, ignore_attrs=(
+            'n_fields', 'n_sequence_fields', 'n_unnamed_fields'))
+
+    _primitives = frozenset((
         types.NoneType,
         types.BooleanType,
         types.FloatType,
         types.IntType,
         types.LongType,
-        types.UnicodeType)
+        types.UnicodeType))
+
+    _nested_types = frozenset((
+        types.DictType,
+        types.ListType,
+        types.TupleType))
 
     _class_match = {
         types.StringType: _pythonize_string,
-        types.ListType: _pythonize_iterable,
-        types.TupleType: _pythonize_iterable}
+        types.DictType: _pythonize_nested,
+        types.ListType: _pythonize_nested,
+        types.TupleType: _pythonize_nested}
 
     _name_match = {
         # FSD-related classes
@@ -0,0 +1,14 @@
+import os
+
+
+def get_current_rss():
+    """
+    Return amount of memory process currently occupies, in bytes. Only Linux
+    exposes it cheaply, on other platforms None is returned.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (IOError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE')
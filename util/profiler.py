@@ -0,0 +1,50 @@
+import cProfile
+import os
+import pstats
+import re
+from contextlib import contextmanager
+
+
+class ContainerProfiler(object):
+    """
+    Profiles processing of containers, storing profile of every
+    container as separate .pstats file and printing its hottest
+    functions.
+    """
+
+    def __init__(self, directory, top=10):
+        self._directory = directory
+        # Amount of functions printed in summary
+        self._top = top
+
+    @contextmanager
+    def profile(self, miner_name, container_name):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(self._get_filepath(miner_name, container_name))
+            self._print_summary(profiler)
+
+    def _get_filepath(self, miner_name, container_name):
+        directory = os.path.join(self._directory, self.__secure_name(miner_name))
+        if not os.path.exists(directory):
+            os.makedirs(directory, mode=0o755)
+        return os.path.join(directory, u'{}.pstats'.format(self.__secure_name(container_name)))
+
+    def _print_summary(self, profiler):
+        """Print functions which took the most time by themselves, excluding time of functions they called."""
+        if not self._top:
+            return
+        # Format: {(file name, line number, function name): (primitive calls, calls, own time, cumulative time, callers)}
+        stats = pstats.Stats(profiler).stats
+        hottest = sorted(stats.iteritems(), key=lambda i: i[1][2], reverse=True)[:self._top]
+        for (file_name, line, function_name), (_, calls, own_time, cumulative_time, _) in hottest:
+            location = function_name if file_name == '~' else u'{} ({}:{})'.format(function_name, file_name, line)
+            print(u'    {:.3f}s own, {:.3f}s total, {} calls: {}'.format(own_time, cumulative_time, calls, location))
+
+    def __secure_name(self, name):
+        # Same as JSON writer does, profiles are named after containers
+        return re.sub(r'[^\w\-.,() ]', '_', name, flags=re.UNICODE)
@@ -3,7 +3,7 @@ import hashlib
 import os
 from collections import namedtuple
 
-from util import cachedproperty
+from util import cachedproperty, stage_stats
 
 
 FileInfo = namedtuple('FileInfo', ('resource_path', 'file_relpath', 'file_abspath', 'file_hash', 'file_size', 'compressed_size'))
@@ -37,7 +37,8 @@ class ResourceBrowser(object):
         """Return metadata for a resource, verifying the resource first if requested."""
         file_info = self._resource_index[resource_path]
         if verify_content:
-            self.__verify_file(file_info=file_info)
+            with stage_stats.stage(u'verification'):
+                self.__verify_file(file_info=file_info)
         return file_info
 
     def get_file_data(self, resource_path):
@@ -46,7 +47,9 @@ class ResourceBrowser(object):
         file_path = file_info.file_abspath
         with open(file_path, 'rb') as f:
             data = f.read()
-        self.__verify_data(data=data, file_info=file_info)
+        stage_stats.add_bytes(read=len(data))
+        with stage_stats.stage(u'verification'):
+            self.__verify_data(data=data, file_info=file_info)
         return data
 
     def __verify_file(self, file_info):
@@ -59,6 +62,7 @@ class ResourceBrowser(object):
                     break
                 size += len(chunk)
                 checksum.update(chunk)
+        stage_stats.add_bytes(read=size)
         if size != file_info.file_size:
             raise FileIntegrityError(u'file size mismatch when reading {}'.format(file_info.resource_path))
         if checksum.hexdigest() != file_info.file_hash:
@@ -0,0 +1,88 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import urllib
+
+
+class SqlitePool(object):
+    """
+    Keeps connections to SQLite databases, one per file, until closed.
+    Client databases are only read, thus they are opened as read-only
+    and immutable when SQLite library allows that.
+    """
+
+    # Format: ((pragma name, value), ...)
+    _pragmas = (
+        # Negative value is size in KiB
+        ('cache_size', -64 * 1024),
+        ('mmap_size', 256 * 1024 * 1024))
+
+    def __init__(self):
+        # Format: {absolute file path: connection}
+        self._connections = {}
+        self.__uri_support = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, file_path):
+        """Return connection to database at passed path, opening it if needed."""
+        file_path = os.path.abspath(file_path)
+        try:
+            return self._connections[file_path]
+        except KeyError:
+            pass
+        if self._uri_support:
+            dbconn = sqlite3.connect(self._get_uri(file_path))
+        else:
+            dbconn = sqlite3.connect(file_path)
+        for pragma_name, value in self._pragmas:
+            dbconn.execute(u'pragma {} = {}'.format(pragma_name, value))
+        self._connections[file_path] = dbconn
+        return dbconn
+
+    def release(self, file_path):
+        """Close connection to database at passed path, if it is open."""
+        dbconn = self._connections.pop(os.path.abspath(file_path), None)
+        if dbconn is not None:
+            dbconn.close()
+
+    def close(self):
+        """Close all the connections opened so far."""
+        for dbconn in self._connections.itervalues():
+            dbconn.close()
+        self._connections.clear()
+
+    def _get_uri(self, file_path):
+        return u'file:{}?mode=ro&immutable=1'.format(urllib.pathname2url(file_path))
+
+    @property
+    def _uri_support(self):
+        """
+        URI file names can be disabled in SQLite library python is built
+        with, and then they are treated as regular file names. Detect it
+        by opening a throwaway database via URI.
+        """
+        if self.__uri_support is None:
+            temp_dir = tempfile.mkdtemp(prefix='phobos-')
+            try:
+                probe_path = os.path.join(temp_dir, 'probe.db')
+                dbconn = sqlite3.connect(probe_path)
+                dbconn.execute('create table probe (id integer)')
+                dbconn.commit()
+                dbconn.close()
+                try:
+                    dbconn = sqlite3.connect(self._get_uri(probe_path))
+                    dbconn.execute('select count(*) from probe')
+                    dbconn.close()
+                except sqlite3.Error:
+                    self.__uri_support = False
+                else:
+                    self.__uri_support = True
+            finally:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+        return self.__uri_support
@@ -0,0 +1,202 @@
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# CPU time of calling thread alone can be taken only on Linux, elsewhere CPU time of the whole process is used
+RUSAGE_THREAD = 1 if resource is not None and sys.platform.startswith('linux') else None
+
+
+class _ThreadState(threading.local):
+    """Container and stages which are being processed by thread."""
+
+    def __init__(self):
+        self.current_key = (None, None)
+        # Format: [stage name]
+        self.stage_stack = []
+        # Counters at the moment time was charged to a stage last time
+        self.mark = None
+
+
+class StageStats(object):
+    """
+    Collects time, memory and I/O figures of data processing stages,
+    separately for every container.
+
+    Stages can be nested; time spent in nested stage is not counted
+    towards enclosing stage, thus every stage reports only its own work.
+    Every thread tracks its own container and stages.
+    """
+
+    # Names of figures collected for every stage, in the order they are reported
+    fields = ('calls', 'wall_time', 'cpu_time', 'peak_rss_delta', 'bytes_read', 'bytes_written')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # Format: {(miner name, container name): {stage name: {field name: value}}}
+        self._records = OrderedDict()
+        self._state = _ThreadState()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def container(self, miner_name, container_name):
+        """Attribute everything happening within context to passed container."""
+        previous_key = self._state.current_key
+        self._state.current_key = (miner_name, container_name)
+        with self._lock:
+            self._records.setdefault(self._state.current_key, OrderedDict())
+        try:
+            yield
+        finally:
+            self._state.current_key = previous_key
+
+    @contextmanager
+    def stage(self, stage_name):
+        """Measure resources consumed by code within context as stage with passed name."""
+        self._charge()
+        self._state.stage_stack.append(stage_name)
+        with self._lock:
+            self._get_stage_record(stage_name)['calls'] += 1
+        try:
+            yield
+        finally:
+            self._charge()
+            self._state.stage_stack.pop()
+
+    def add_bytes(self, read=0, written=0):
+        """Account I/O against stage which is currently running."""
+        stage_stack = self._state.stage_stack
+        stage_name = stage_stack[-1] if stage_stack else u'other'
+        with self._lock:
+            record = self._get_stage_record(stage_name)
+            record['bytes_read'] += read
+            record['bytes_written'] += written
+
+    def add_count(self, name, amount=1):
+        """
+        Count events of some kind within stage which is currently running;
+        counts are reported next to regular figures of the stage.
+        """
+        stage_stack = self._state.stage_stack
+        stage_name = stage_stack[-1] if stage_stack else u'other'
+        with self._lock:
+            record = self._get_stage_record(stage_name)
+            record[name] = record.get(name, 0) + amount
+
+    def get_container_stats(self, miner_name, container_name):
+        """
+        Return stats for single container.
+        Format: {stage name: {field name: value}}
+        """
+        # Copy, as other threads can be adding stages to it
+        with self._lock:
+            return OrderedDict(self._records.get((miner_name, container_name), {}))
+
+    def format_container(self, miner_name, container_name):
+        """Return short human-readable summary of container stats."""
+        parts = []
+        for stage_name, record in self.get_container_stats(miner_name, container_name).items():
+            parts.append(u'{} {:.3f}s'.format(stage_name, record['wall_time']))
+        return u', '.join(parts)
+
+    def write_report(self, file_path):
+        """Write all collected stats into file, CSV if file has such extension, JSON otherwise."""
+        if os.path.splitext(file_path)[1].lower() == '.csv':
+            self.__write_csv(file_path)
+        else:
+            self.__write_json(file_path)
+
+    def _get_stage_record(self, stage_name):
+        # Has to be called with lock held
+        stages = self._records.setdefault(self._state.current_key, OrderedDict())
+        try:
+            return stages[stage_name]
+        except KeyError:
+            record = stages[stage_name] = OrderedDict((field, 0) for field in self.fields)
+            return record
+
+    def _charge(self):
+        """Add resources consumed since last mark to stage which is on top of stack."""
+        state = self._state
+        mark = self._get_counters()
+        if state.stage_stack and state.mark is not None:
+            with self._lock:
+                record = self._get_stage_record(state.stage_stack[-1])
+                record['wall_time'] += mark[0] - state.mark[0]
+                record['cpu_time'] += mark[1] - state.mark[1]
+                record['peak_rss_delta'] += mark[2] - state.mark[2]
+        state.mark = mark
+
+    def _get_counters(self):
+        if RUSAGE_THREAD is not None:
+            usage = resource.getrusage(RUSAGE_THREAD)
+            cpu_time = usage.ru_utime + usage.ru_stime
+        else:
+            times = os.times()
+            cpu_time = times[0] + times[1]
+        return time.time(), cpu_time, self._get_peak_rss()
+
+    def _get_peak_rss(self):
+        """Return peak resident set size of the process in bytes, or 0 if it's not available."""
+        if resource is None:
+            return 0
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports it in kilobytes, Mac OS - in bytes
+        if sys.platform != 'darwin':
+            peak_rss *= 1024
+        return peak_rss
+
+    def __row_iter(self):
+        for (miner_name, container_name), stages in self._records.items():
+            for stage_name, record in stages.items():
+                yield miner_name, container_name, stage_name, record
+
+    def __write_json(self, file_path):
+        # Format: [{miner: miner name, container: container name, stages: {stage name: {field name: value}}}]
+        report = []
+        for (miner_name, container_name), stages in self._records.items():
+            if not stages:
+                continue
+            report.append(OrderedDict((
+                ('miner', miner_name),
+                ('container', container_name),
+                ('stages', stages))))
+        with open(file_path, 'wb') as f:
+            json.dump(report, f, indent=2)
+
+    def __write_csv(self, file_path):
+        # Counts go after regular figures, and are empty for stages which do not have them
+        count_names = sorted(set(
+            name for _, _, _, record in self.__row_iter() for name in record if name not in self.fields))
+        with open(file_path, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(('miner', 'container', 'stage') + self.fields + tuple(count_names))
+            for miner_name, container_name, stage_name, record in self.__row_iter():
+                row = [self.__encode(miner_name), self.__encode(container_name), self.__encode(stage_name)]
+                row.extend(record[field] for field in self.fields)
+                row.extend(record.get(name, '') for name in count_names)
+                writer.writerow(row)
+
+    def __encode(self, value):
+        # CSV module of python 2 deals with byte strings only
+        if value is None:
+            return ''
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value
+
+
+# Shared by everything which takes part in the run, so that miners and
+# writers can report stages without having collector passed around
+stage_stats = StageStats()
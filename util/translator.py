@@ -2,6 +2,7 @@ import re
 import types
 
 from miner import ContainerNotFoundError
+from util import stage_stats
 
 
 class Translator(object):
@@ -17,7 +18,7 @@ class Translator(object):
         self.__available_langs = None
         self.__label_map = None
 
-    def translate_container(self, container_data, language, spec=None, verbose=False):
+    def translate_container(self, container_data, language, spec=None, verbose=False, stats=None):
         """
         Translate text fields in passed container to specified language.
 
@@ -29,13 +30,35 @@ class Translator(object):
         If spec argument is passed (list of fieldNames which should be inserted into row, if
         fieldNameID is present), then it is used to detect translatable fields instead of automatic
         detection.
+
+        If stats argument is passed, stats are accumulated into it, which allows to translate
+        container in several parts and print stats for all of them at once.
         """
         if not language:
             return
-        stats = {}
-        self._route_object(container_data, language, spec, stats)
+        if stats is None:
+            stats = {}
+        with stage_stats.stage(u'translation'):
+            self._route_object(container_data, language, spec, stats)
         if verbose:
-            self._print_current_stats(stats)
+            self.print_stats(stats)
+
+    def translate_copy(self, container_data, language, spec=None, verbose=False, stats=None):
+        """
+        Return translated copy of passed container, leaving container itself
+        intact. Only maps and iterables which have something translated in
+        them are copied, everything else is shared with passed container.
+        Arguments are the same as for translate_container.
+        """
+        if not language:
+            return container_data
+        if stats is None:
+            stats = {}
+        with stage_stats.stage(u'translation'):
+            translated_data = self._copy_object(container_data, language, spec, stats)
+        if verbose:
+            self.print_stats(stats)
+        return translated_data
 
     # Related to recursive translation
 
@@ -63,7 +86,10 @@ class Translator(object):
             self._route_object(key, language, spec, stats)
             self._route_object(value, language, spec, stats)
         # Now, try to actually translate stuff
-        for text_fname, msgid_fname in self.__translatable_fields_iter(obj, spec):
+        self.__translate_fields(obj, self.__translatable_fields_iter(obj, spec), language, stats)
+
+    def __translate_fields(self, obj, fields, language, stats):
+        for text_fname, msgid_fname in fields:
             self.__increment_stats(stats, text_fname, 0)
             msgid = obj[msgid_fname]
             # Multi-mode translation just stores all the data it can fetch with no extra logic;
@@ -86,6 +112,48 @@ class Translator(object):
         types.TupleType: _translate_iterable,
         types.ListType: _translate_iterable}
 
+    # Related to copying translation. Methods return passed object itself
+    # when there is nothing to translate in it
+
+    def _copy_object(self, obj, language, spec, stats):
+        method = self._copying_map.get(type(obj))
+        if method is None:
+            return obj
+        return method(self, obj, language, spec, stats)
+
+    def _copy_map(self, obj, language, spec, stats):
+        new_obj = None
+        # Keys are hashable, thus they cannot contain anything translatable
+        for key, value in obj.iteritems():
+            new_value = self._copy_object(value, language, spec, stats)
+            if new_value is not value:
+                if new_obj is None:
+                    new_obj = dict(obj)
+                new_obj[key] = new_value
+        fields = list(self.__translatable_fields_iter(obj, spec))
+        if fields:
+            if new_obj is None:
+                new_obj = dict(obj)
+            self.__translate_fields(new_obj, fields, language, stats)
+        return obj if new_obj is None else new_obj
+
+    def _copy_iterable(self, obj, language, spec, stats):
+        new_items = None
+        for index, item in enumerate(obj):
+            new_item = self._copy_object(item, language, spec, stats)
+            if new_item is not item:
+                if new_items is None:
+                    new_items = list(obj)
+                new_items[index] = new_item
+        if new_items is None:
+            return obj
+        return new_items if type(obj) is types.ListType else tuple(new_items)
+
+    _copying_map = {
+        types.DictType: _copy_map,
+        types.TupleType: _copy_iterable,
+        types.ListType: _copy_iterable}
+
     def __translation_multimode(self, data_row, text_fname, msgid, stats):
         """
         Translate one field into every language which has a translation for it, and write them
@@ -200,7 +268,7 @@ class Translator(object):
             stats[field_name] = statlist
         statlist[place] += amount
 
-    def _print_current_stats(self, stats):
+    def print_stats(self, stats):
         """
         Print stats for container which has just been translated.
         """
@@ -213,6 +281,28 @@ class Translator(object):
             print(u'    field {}: {} entries, {} translations'.format(field_name, total, trans))
 
     # Related to loading language data
+    def get_inputs(self, language):
+        """Return list of language inputs translation into passed language needs."""
+        if not language:
+            return []
+        if language == 'multi':
+            return [('language', l) for l in self.available_langs]
+        # English is used as fallback
+        return [('language', language), ('language', 'en-us')]
+
+    def release_language(self, language):
+        """Forget texts of single language, they are loaded again when needed."""
+        self._loaded_langs.pop(language, None)
+
+    def release_caches(self):
+        """
+        Forget loaded texts, they are loaded again when needed. Return True
+        if anything was dropped.
+        """
+        released = bool(self._loaded_langs)
+        self._loaded_langs.clear()
+        return released
+
     def _load_pickle(self, name):
         return self._pickle_miner.get_data(name)
 
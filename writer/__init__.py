@@ -1,6 +1,15 @@
+from .binary_writer import BinaryReader, BinaryWriter
+from .columnar_writer import ColumnarWriter
 from .json_writer import JsonWriter
+from .manifest import Manifest
+from .sqlite_writer import SqliteWriter
 
 
 __all__ = (
+    'BinaryReader',
+    'BinaryWriter',
+    'ColumnarWriter',
     'JsonWriter',
+    'Manifest',
+    'SqliteWriter',
 )
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import tempfile
+
+
+# Policies of flushing written files to storage device:
+# never - leave it to operating system;
+# file - flush contents of every file before it gets its name;
+# directory - also flush directory after file is renamed, so that rename survives crash as well
+FSYNC_POLICIES = ('never', 'file', 'directory')
+
+# Files created by mkstemp are accessible by owner only, while regular files follow umask
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+if os.name == 'nt':
+    import ctypes
+    import sys
+
+    _kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    _MOVEFILE_REPLACE_EXISTING = 0x1
+    _MOVEFILE_WRITE_THROUGH = 0x8
+
+    def _replace_file(source_filepath, filepath):
+        """
+        Rename file over existing one in single step. os.rename refuses to do it
+        on Windows, and removal followed by rename leaves no file if interrupted.
+        """
+        encoding = sys.getfilesystemencoding()
+        source_filepath, filepath = [
+            p.decode(encoding) if isinstance(p, str) else p for p in (source_filepath, filepath)]
+        if not _kernel32.MoveFileExW(source_filepath, filepath, _MOVEFILE_REPLACE_EXISTING | _MOVEFILE_WRITE_THROUGH):
+            raise ctypes.WinError(ctypes.get_last_error())
+else:
+    # Rename replaces existing file atomically on POSIX systems
+    _replace_file = os.rename
+
+
+class AtomicFile(object):
+    """
+    Binary file, which is written under temporary name in the same
+    directory, and renamed to its actual name once it is complete.
+    Consumers never see partially written file, and file which was
+    there before is kept if writing fails.
+
+    When manifest is passed, file is recorded in it, and file which
+    already has the same contents is left untouched.
+    """
+
+    def __init__(self, filepath, fsync='never', manifest=None):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(u'unknown fsync policy {}'.format(fsync))
+        self.filepath = filepath
+        self._fsync = fsync
+        directory, file_name = os.path.split(filepath)
+        fd, self._temp_filepath = tempfile.mkstemp(prefix=u'.{}.'.format(file_name), suffix=u'.tmp', dir=directory)
+        self._file = os.fdopen(fd, 'wb')
+        self._manifest = manifest
+        self._hash = hashlib.sha256() if manifest is not None else None
+        self._size = 0
+
+    def write(self, data):
+        self._file.write(data)
+        self._size += len(data)
+        if self._hash is not None:
+            self._hash.update(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        """Finish writing and give file its name."""
+        if self._file.closed:
+            return
+        self._file.flush()
+        if self._fsync != 'never':
+            os.fsync(self._file.fileno())
+        self._file.close()
+        if self._manifest is not None and self.__reuse_existing():
+            return
+        os.chmod(self._temp_filepath, 0o666 & ~_umask)
+        self.__replace(self._temp_filepath)
+        if self._fsync == 'directory' and os.name != 'nt':
+            fd = os.open(os.path.dirname(self.filepath) or u'.', os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def abort(self):
+        """Get rid of written data, leaving file which was there before intact."""
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self._temp_filepath):
+            os.remove(self._temp_filepath)
+
+    def __reuse_existing(self):
+        """
+        Record file in manifest, and keep file with the same contents if
+        there is one, either at file path or in previous dump. Return True
+        if written file is not needed.
+        """
+        digest = self._hash.hexdigest()
+        self._manifest.add(self.filepath, digest, self._size)
+        if self._manifest.is_unchanged(self.filepath, digest, self._size):
+            os.remove(self._temp_filepath)
+            return True
+        previous_filepath = self._manifest.get_previous(self.filepath, digest, self._size)
+        if previous_filepath is None:
+            return False
+        # Link is made under temporary name too, to replace file atomically
+        link_filepath = u'{}.link'.format(self._temp_filepath)
+        try:
+            os.link(previous_filepath, link_filepath)
+        except (AttributeError, OSError):
+            # Links are not supported by platform or file system, or dumps are on different devices
+            return False
+        os.remove(self._temp_filepath)
+        self.__replace(link_filepath)
+        return True
+
+    def __replace(self, source_filepath):
+        _replace_file(source_filepath, self.filepath)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
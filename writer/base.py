@@ -11,3 +11,38 @@ class BaseWriter(object):
     @abstractmethod
     def write(self, miner_name, container_name, container_data):
         raise NotImplementedError
+
+    def open_stream(self, miner_name, container_name):
+        """
+        Return sink, which receives container data as several
+        lists of rows. As default implementation, rows are
+        collected and written all at once when sink is closed.
+        """
+        return BufferedRowSink(self, miner_name, container_name)
+
+    def close(self):
+        """Finish writing, called when all the containers are written."""
+        pass
+
+
+class BufferedRowSink(object):
+    """
+    Sink which collects all the rows passed to it, and
+    hands them over to regular writer method on close.
+    """
+
+    def __init__(self, writer, miner_name, container_name):
+        self._writer = writer
+        self._miner_name = miner_name
+        self._container_name = container_name
+        self._rows = []
+
+    def write_rows(self, rows):
+        self._rows.extend(rows)
+
+    def close(self):
+        self._writer.write(miner_name=self._miner_name, container_name=self._container_name, container_data=self._rows)
+        self._rows = None
+
+    def abort(self):
+        self._rows = None
@@ -0,0 +1,426 @@
+"""
+Compact binary format, meant for loaders which need only few entries
+of a container and do not want to parse all of it.
+
+File layout:
+- header: magic 'PHBN', format version and kind of container
+  (map, list or plain value), 8 bytes in total;
+- records: every top-level entry of container, encoded with
+  MessagePack separately from the others;
+- index: MessagePack array of [key, record offset, record length],
+  keys of lists are positions of their items;
+- footer: index offset, index length and magic, 16 bytes in total.
+
+All integers of header and footer are big-endian. Loader reads footer
+and index, and then can decode any record without touching the rest
+of the file, e.g. when file is memory-mapped.
+"""
+
+
+import mmap
+import os.path
+import re
+import struct
+import types
+from collections import OrderedDict
+
+from util import stage_stats
+from .atomic_file import AtomicFile
+from .base import BaseWriter
+from .canonical import sorted_keys
+
+
+MAGIC = 'PHBN'
+VERSION = 1
+# Kinds of containers
+KIND_MAP = 0
+KIND_LIST = 1
+KIND_VALUE = 2
+
+HEADER = struct.Struct('>4sBB2x')
+FOOTER = struct.Struct('>QI4s')
+
+
+class BinaryFormatError(Exception):
+    """Raised when file is not in format produced by binary writer."""
+
+
+def pack(obj):
+    """Encode python object into MessagePack."""
+    chunks = []
+    _pack_object(obj, chunks)
+    return ''.join(chunks)
+
+
+def _pack_object(obj, chunks):
+    method = _packing_map.get(type(obj))
+    if method is None:
+        # Subclasses of basic types are encoded as their base
+        for obj_type, obj_method in _packing_map.iteritems():
+            if isinstance(obj, obj_type):
+                method = obj_method
+                break
+        else:
+            raise TypeError(u'unable to encode object of type {}'.format(type(obj).__name__))
+    method(obj, chunks)
+
+
+def _pack_none(obj, chunks):
+    chunks.append('\xc0')
+
+
+def _pack_bool(obj, chunks):
+    chunks.append('\xc3' if obj else '\xc2')
+
+
+def _pack_int(obj, chunks):
+    if 0 <= obj < 0x80:
+        chunks.append(chr(obj))
+    elif -0x20 <= obj < 0:
+        chunks.append(struct.pack('>b', obj))
+    elif 0 <= obj <= 0xff:
+        chunks.append(struct.pack('>BB', 0xcc, obj))
+    elif 0 <= obj <= 0xffff:
+        chunks.append(struct.pack('>BH', 0xcd, obj))
+    elif 0 <= obj <= 0xffffffff:
+        chunks.append(struct.pack('>BI', 0xce, obj))
+    elif 0 <= obj <= 0xffffffffffffffff:
+        chunks.append(struct.pack('>BQ', 0xcf, obj))
+    elif -0x80 <= obj < 0:
+        chunks.append(struct.pack('>Bb', 0xd0, obj))
+    elif -0x8000 <= obj < 0:
+        chunks.append(struct.pack('>Bh', 0xd1, obj))
+    elif -0x80000000 <= obj < 0:
+        chunks.append(struct.pack('>Bi', 0xd2, obj))
+    elif -0x8000000000000000 <= obj < 0:
+        chunks.append(struct.pack('>Bq', 0xd3, obj))
+    else:
+        raise ValueError(u'integer {} does not fit into 64 bits'.format(obj))
+
+
+def _pack_float(obj, chunks):
+    chunks.append(struct.pack('>Bd', 0xcb, obj))
+
+
+def _pack_bytestring(obj, chunks):
+    # Byte strings are treated as UTF-8 text, the same way JSON encoder does it
+    _pack_text(obj.decode('utf-8'), chunks)
+
+
+def _pack_text(obj, chunks):
+    data = obj.encode('utf-8')
+    size = len(data)
+    if size < 0x20:
+        chunks.append(chr(0xa0 | size))
+    elif size <= 0xff:
+        chunks.append(struct.pack('>BB', 0xd9, size))
+    elif size <= 0xffff:
+        chunks.append(struct.pack('>BH', 0xda, size))
+    else:
+        chunks.append(struct.pack('>BI', 0xdb, size))
+    chunks.append(data)
+
+
+def _pack_iterable(obj, chunks):
+    size = len(obj)
+    if size < 0x10:
+        chunks.append(chr(0x90 | size))
+    elif size <= 0xffff:
+        chunks.append(struct.pack('>BH', 0xdc, size))
+    else:
+        chunks.append(struct.pack('>BI', 0xdd, size))
+    for item in obj:
+        _pack_object(item, chunks)
+
+
+def _pack_map(obj, chunks):
+    size = len(obj)
+    if size < 0x10:
+        chunks.append(chr(0x80 | size))
+    elif size <= 0xffff:
+        chunks.append(struct.pack('>BH', 0xde, size))
+    else:
+        chunks.append(struct.pack('>BI', 0xdf, size))
+    # Keys are sorted the same way as in JSON, to get identical files out of identical data
+    for k in sorted_keys(obj):
+        _pack_object(k, chunks)
+        _pack_object(obj[k], chunks)
+
+
+_packing_map = {
+    types.NoneType: _pack_none,
+    types.BooleanType: _pack_bool,
+    types.IntType: _pack_int,
+    types.LongType: _pack_int,
+    types.FloatType: _pack_float,
+    types.StringType: _pack_bytestring,
+    types.UnicodeType: _pack_text,
+    types.TupleType: _pack_iterable,
+    types.ListType: _pack_iterable,
+    types.DictType: _pack_map,
+    OrderedDict: _pack_map}
+
+
+def unpack(data, offset=0):
+    """
+    Decode MessagePack object which starts at offset of data.
+    Return decoded object and offset right after it.
+    """
+    code = ord(data[offset])
+    offset += 1
+    if code < 0x80:
+        return code, offset
+    if code >= 0xe0:
+        return code - 0x100, offset
+    if 0xa0 <= code <= 0xbf:
+        return _unpack_text(data, offset, code & 0x1f)
+    if 0x90 <= code <= 0x9f:
+        return _unpack_iterable(data, offset, code & 0x0f)
+    if 0x80 <= code <= 0x8f:
+        return _unpack_map(data, offset, code & 0x0f)
+    try:
+        fmt, method = _unpacking_map[code]
+    except KeyError:
+        raise BinaryFormatError(u'unknown type code 0x{:02x} at offset {}'.format(code, offset - 1))
+    if fmt is None:
+        return method, offset
+    value = struct.unpack_from(fmt, data, offset)[0]
+    offset += struct.calcsize(fmt)
+    if method is None:
+        return value, offset
+    return method(data, offset, value)
+
+
+def _unpack_text(data, offset, size):
+    end = offset + size
+    return data[offset:end].decode('utf-8'), end
+
+
+def _unpack_bytes(data, offset, size):
+    end = offset + size
+    return data[offset:end], end
+
+
+def _unpack_iterable(data, offset, size):
+    items = []
+    for _ in xrange(size):
+        item, offset = unpack(data, offset)
+        items.append(item)
+    return items, offset
+
+
+def _unpack_map(data, offset, size):
+    obj = {}
+    for _ in xrange(size):
+        k, offset = unpack(data, offset)
+        v, offset = unpack(data, offset)
+        # Lists cannot be used as keys
+        if isinstance(k, list):
+            k = _freeze(k)
+        obj[k] = v
+    return obj, offset
+
+
+def _freeze(obj):
+    if isinstance(obj, list):
+        return tuple(_freeze(i) for i in obj)
+    return obj
+
+
+# Format: {type code: (struct format of value following the code, function to decode the rest
+# with value as argument)}; objects without value have object itself in place of function
+_unpacking_map = {
+    0xc0: (None, None),
+    0xc2: (None, False),
+    0xc3: (None, True),
+    0xc4: ('>B', _unpack_bytes),
+    0xc5: ('>H', _unpack_bytes),
+    0xc6: ('>I', _unpack_bytes),
+    0xca: ('>f', None),
+    0xcb: ('>d', None),
+    0xcc: ('>B', None),
+    0xcd: ('>H', None),
+    0xce: ('>I', None),
+    0xcf: ('>Q', None),
+    0xd0: ('>b', None),
+    0xd1: ('>h', None),
+    0xd2: ('>i', None),
+    0xd3: ('>q', None),
+    0xd9: ('>B', _unpack_text),
+    0xda: ('>H', _unpack_text),
+    0xdb: ('>I', _unpack_text),
+    0xdc: ('>H', _unpack_iterable),
+    0xdd: ('>I', _unpack_iterable),
+    0xde: ('>H', _unpack_map),
+    0xdf: ('>I', _unpack_map)}
+
+
+class BinaryWriter(BaseWriter):
+    """
+    Class, which stores fetched data on storage device
+    as indexed binary files.
+    """
+
+    def __init__(self, directory, fsync='never'):
+        self.base_dir = directory
+        # Policy of flushing files to storage device, see AtomicFile
+        self.fsync = fsync
+
+    def write(self, miner_name, container_name, container_data):
+        filepath = self._get_filepath(self._get_directory(miner_name), container_name)
+        if isinstance(container_data, dict):
+            kind = KIND_MAP
+            items = ((k, container_data[k]) for k in sorted_keys(container_data))
+        elif isinstance(container_data, (list, tuple)):
+            kind = KIND_LIST
+            items = enumerate(container_data)
+        else:
+            kind = KIND_VALUE
+            items = ((None, container_data),)
+        with BinaryFile(filepath, kind, fsync=self.fsync) as f:
+            for k, v in items:
+                f.write_record(k, v)
+
+    def open_stream(self, miner_name, container_name):
+        return BinaryRowSink(self, miner_name, container_name)
+
+    def _get_directory(self, miner_name):
+        directory = os.path.join(self.base_dir, self.__secure_name(miner_name))
+        if not os.path.exists(directory):
+            os.makedirs(directory, mode=0o755)
+        return directory
+
+    def _get_filepath(self, directory, container_name):
+        return os.path.join(directory, u'{}.phb'.format(self.__secure_name(container_name)))
+
+    def __secure_name(self, name):
+        # Same as JSON writer does, to keep file names of both writers in sync
+        return re.sub(r'[^\w\-.,() ]', '_', name, flags=re.UNICODE)
+
+
+class BinaryFile(object):
+    """Writes records one by one, and finishes file with index on close."""
+
+    def __init__(self, filepath, kind, fsync='never'):
+        self.filepath = filepath
+        self._file = AtomicFile(filepath, fsync=fsync)
+        self._file.write(HEADER.pack(MAGIC, VERSION, kind))
+        self._offset = HEADER.size
+        # Format: [[key, offset, length]]
+        self._index = []
+
+    def write_record(self, key, value):
+        data = pack(value)
+        self._file.write(data)
+        self._index.append([key, self._offset, len(data)])
+        self._offset += len(data)
+
+    def close(self):
+        index_data = pack(self._index)
+        self._file.write(index_data)
+        self._file.write(FOOTER.pack(self._offset, len(index_data), MAGIC))
+        self._file.close()
+        stage_stats.add_bytes(written=self._offset + len(index_data) + FOOTER.size)
+
+    def abort(self):
+        self._file.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class BinaryRowSink(object):
+    """
+    Writes rows into binary file as they come, producing the same
+    output as binary writer does for list of all those rows.
+    """
+
+    def __init__(self, writer, miner_name, container_name):
+        filepath = writer._get_filepath(writer._get_directory(miner_name), container_name)
+        self._file = BinaryFile(filepath, KIND_LIST, fsync=writer.fsync)
+        self._row_count = 0
+
+    def write_rows(self, rows):
+        for row in rows:
+            self._file.write_record(self._row_count, row)
+            self._row_count += 1
+
+    def close(self):
+        self._file.close()
+
+    def abort(self):
+        """Get rid of everything written so far."""
+        self._file.abort()
+
+
+class BinaryReader(object):
+    """
+    Reads entries of files produced by binary writer. File is
+    memory-mapped, and only requested entries are decoded.
+    """
+
+    def __init__(self, filepath):
+        self._file = open(filepath, 'rb')
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._data) < HEADER.size + FOOTER.size:
+            raise BinaryFormatError(u'file is too short')
+        magic, version, self.kind = HEADER.unpack_from(self._data, 0)
+        index_offset, index_length, footer_magic = FOOTER.unpack_from(self._data, len(self._data) - FOOTER.size)
+        if magic != MAGIC or footer_magic != MAGIC:
+            raise BinaryFormatError(u'file has no magic')
+        if version != VERSION:
+            raise BinaryFormatError(u'unsupported version {}'.format(version))
+        index, _ = unpack(self._data, index_offset)
+        # Format: {key: (record offset, record length)}
+        self._index = dict((_freeze(k), (offset, length)) for k, offset, length in index)
+        # Format: [key], in the order records were written
+        self._keys = [_freeze(k) for k, _, _ in index]
+
+    def keys(self):
+        return list(self._keys)
+
+    def get(self, key, default=None):
+        try:
+            offset, _ = self._index[key]
+        except KeyError:
+            return default
+        value, _ = unpack(self._data, offset)
+        return value
+
+    def load(self):
+        """Decode whole container."""
+        if self.kind == KIND_MAP:
+            return dict((k, self.get(k)) for k in self._keys)
+        if self.kind == KIND_LIST:
+            return [self.get(k) for k in self._keys]
+        return self.get(None)
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __getitem__(self, key):
+        offset, _ = self._index[key]
+        value, _ = unpack(self._data, offset)
+        return value
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,54 @@
+import types
+from collections import OrderedDict
+
+from .json_writer import natural_sort
+
+
+def canonicalize(obj):
+    """
+    Return copy of container data in form which all the writers expect:
+    maps are ordered dictionaries with naturally sorted keys, and
+    sequences are lists. Writers take order of ordered dictionaries
+    as is, thus data is traversed and sorted only once, no matter how
+    many writers it is passed to.
+
+    Integer and string keys are kept as they are, so that writers which
+    can make use of integer keys still get them; any other keys are
+    converted to strings, the same way JSON writer does it.
+    """
+    method = _canonicalizing_map.get(type(obj))
+    if method is None:
+        return obj
+    return method(obj)
+
+
+def sorted_keys(obj):
+    """Return keys of map in the order writers should store them."""
+    if isinstance(obj, OrderedDict):
+        return list(obj)
+    return sorted(obj, key=natural_sort)
+
+
+def _canonicalize_map(obj):
+    new_obj = OrderedDict()
+    for k in sorted(obj, key=natural_sort):
+        new_obj[_canonicalize_key(k)] = canonicalize(obj[k])
+    return new_obj
+
+
+def _canonicalize_iterable(obj):
+    return [canonicalize(item) for item in obj]
+
+
+def _canonicalize_key(key):
+    if type(key) in _plain_key_types:
+        return key
+    return unicode(key)
+
+
+_canonicalizing_map = {
+    types.DictType: _canonicalize_map,
+    types.TupleType: _canonicalize_iterable,
+    types.ListType: _canonicalize_iterable}
+
+_plain_key_types = (types.IntType, types.LongType, types.StringType, types.UnicodeType)
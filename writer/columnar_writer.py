@@ -0,0 +1,292 @@
+"""
+Columnar output for containers which are tables of rows, meant to be
+memory-mapped by analytics tools like NumPy.
+
+Every container is written as directory, with file per column in
+NumPy .npy format (version 1.0, little-endian, one-dimensional):
+- numeric and boolean columns are stored as they are;
+- string columns are dictionary-encoded: .npy file holds int32 index
+  into list of distinct strings, which is stored next to it as
+  <column>.dict.json;
+- columns with values of mixed types or nested values are encoded as
+  JSON text first, and then dictionary-encoded like strings.
+When column has no value in some rows, <column>.mask.npy with boolean
+flag of value presence is written as well. Layout of container is
+described by meta.json in the same directory.
+
+Rows which are passed in chunks are spooled into temporary file column
+by column, and column files are written out of it once all rows are seen.
+"""
+
+
+import cPickle
+import os.path
+import re
+import struct
+import tempfile
+import types
+
+from util import stage_stats
+from .atomic_file import AtomicFile
+from .base import BaseWriter
+from .canonical import sorted_keys
+from .json_writer import CustomEncoder, natural_sort
+
+
+NPY_MAGIC = '\x93NUMPY\x01\x00'
+
+# Amount of values of missing column, which are passed to column writer at once
+PADDING_CHUNK_SIZE = 10000
+
+
+class ColumnarWriter(BaseWriter):
+    """
+    Class, which stores containers consisting of rows as
+    directories with file per column.
+    """
+
+    def __init__(self, directory, fsync='never'):
+        self.base_dir = directory
+        # Policy of flushing files to storage device, see AtomicFile
+        self.fsync = fsync
+        self._encoder = CustomEncoder(ensure_ascii=False, separators=(',', ':'), sort_keys=False)
+
+    def write(self, miner_name, container_name, container_data):
+        key_column, column_names, rows = self._get_rows(container_data)
+        # Containers which are not tables do not benefit from columnar layout
+        if rows is None:
+            return
+        directory = self._get_directory(miner_name, container_name)
+        columns = []
+        for column_index, column_name in enumerate(column_names):
+            values = [row.get(column_name) for row in rows]
+            stats = _ColumnStats()
+            stats.add(values)
+            columns.append(self._write_column(directory, column_index, column_name, stats, lambda values=values: [values]))
+        self._write_meta(directory, key_column, len(rows), columns)
+
+    def open_stream(self, miner_name, container_name):
+        return ColumnarRowSink(self, miner_name, container_name)
+
+    def _get_directory(self, miner_name, container_name):
+        directory = os.path.join(self.base_dir, self.__secure_name(miner_name), self.__secure_name(container_name))
+        if not os.path.exists(directory):
+            os.makedirs(directory, mode=0o755)
+        return directory
+
+    def _write_meta(self, directory, key_column, row_count, columns):
+        meta = {u'key_column': key_column, u'rows': row_count, u'columns': columns}
+        self.__write_json(os.path.join(directory, u'meta.json'), meta)
+
+    def _get_rows(self, container_data):
+        """
+        Return rows of container if it is a table, i.e. list of maps, or map
+        of maps; keys of outer map are added to rows as extra column.
+        Format: (key column name or None, [column name], [row])
+        """
+        if isinstance(container_data, dict):
+            keys = sorted_keys(container_data)
+            rows = [container_data[k] for k in keys]
+        elif isinstance(container_data, (list, tuple)):
+            keys = None
+            rows = container_data
+        else:
+            return None, None, None
+        if not rows or not all(isinstance(row, dict) for row in rows):
+            return None, None, None
+        column_names = set()
+        for row in rows:
+            column_names.update(row)
+        column_names = sorted(column_names, key=natural_sort)
+        if keys is None:
+            return None, column_names, rows
+        key_column = u'key'
+        while key_column in column_names:
+            key_column = u'_' + key_column
+        keyed_rows = []
+        for k, row in zip(keys, rows):
+            row = dict(row)
+            row[key_column] = k
+            keyed_rows.append(row)
+        return key_column, [key_column] + column_names, keyed_rows
+
+    def _write_column(self, directory, column_index, column_name, stats, chunk_iter):
+        """
+        Write column files, and return description of column. Values are
+        taken as lists from iterator which function returns, function is
+        called as many times as values are needed.
+        """
+        file_name = u'{}.{}'.format(column_index, self.__secure_name(unicode(column_name)))
+        column_info = {u'name': column_name}
+        if stats.missing:
+            self.__write_npy(
+                os.path.join(directory, u'{}.mask.npy'.format(file_name)), '|b1', '?', stats.count,
+                ([v is not None for v in values] for values in chunk_iter()))
+            column_info[u'mask'] = u'{}.mask.npy'.format(file_name)
+        kind = stats.get_kind()
+        if kind in self._numeric_kinds:
+            descr, fmt, default = self._numeric_kinds[kind]
+            if kind == u'int' and stats.int32:
+                descr, fmt = '<i4', 'i'
+            encoded_iter = ([default if v is None else v for v in values] for values in chunk_iter())
+        else:
+            if kind == u'str':
+                encode = lambda v: v.decode('utf-8') if isinstance(v, str) else v
+            else:
+                encode = lambda v: unicode(self._encoder.encode(v))
+            # Strings are replaced with their positions in list of distinct strings; missing values become -1
+            dictionary = sorted(set(encode(v) for values in chunk_iter() for v in values if v is not None))
+            positions = dict((v, i) for i, v in enumerate(dictionary))
+            encoded_iter = ([-1 if v is None else positions[encode(v)] for v in values] for values in chunk_iter())
+            descr, fmt = '<i4', 'i'
+            self.__write_json(os.path.join(directory, u'{}.dict.json'.format(file_name)), dictionary)
+            column_info[u'dictionary'] = u'{}.dict.json'.format(file_name)
+        self.__write_npy(os.path.join(directory, u'{}.npy'.format(file_name)), descr, fmt, stats.count, encoded_iter)
+        column_info[u'file'] = u'{}.npy'.format(file_name)
+        column_info[u'kind'] = kind
+        column_info[u'dtype'] = descr
+        return column_info
+
+    def __write_npy(self, filepath, descr, fmt, count, value_iter):
+        header = u"{{'descr': '{}', 'fortran_order': False, 'shape': ({},), }}".format(descr, count)
+        # Data has to start at offset aligned to 64 bytes
+        padding = 64 - (len(NPY_MAGIC) + 2 + len(header) + 1) % 64
+        header = (header + u' ' * padding + u'\n').encode('latin1')
+        with AtomicFile(filepath, fsync=self.fsync) as f:
+            f.write(NPY_MAGIC)
+            f.write(struct.pack('<H', len(header)))
+            f.write(header)
+            for values in value_iter:
+                f.write(struct.pack('<{}{}'.format(len(values), fmt), *values))
+        stage_stats.add_bytes(written=os.path.getsize(filepath))
+
+    def __write_json(self, filepath, data):
+        with AtomicFile(filepath, fsync=self.fsync) as f:
+            f.write(unicode(self._encoder.encode(data)).encode('utf-8'))
+        stage_stats.add_bytes(written=os.path.getsize(filepath))
+
+    def __secure_name(self, name):
+        # Same as JSON writer does
+        return re.sub(r'[^\w\-.,() ]', '_', name, flags=re.UNICODE)
+
+    # Format: {kind of column: (numpy type, struct format, value in place of missing one)}
+    _numeric_kinds = {
+        u'bool': ('|b1', '?', False),
+        u'int': ('<i8', 'q', 0),
+        u'float': ('<f8', 'd', float('nan'))}
+
+
+class ColumnarRowSink(object):
+    """
+    Sink which spools values of every column into temporary file as rows
+    come, and writes column files out of it once all rows are passed,
+    without holding rows in memory.
+    """
+
+    def __init__(self, writer, miner_name, container_name):
+        self._writer = writer
+        self._miner_name = miner_name
+        self._container_name = container_name
+        self._file = tempfile.TemporaryFile()
+        self._row_count = 0
+        # Columns are written only if all rows are maps
+        self._table = True
+        # Format: {column name: [column stats, amount of rows before column appeared, [offset of chunk in file]]}
+        self._columns = {}
+
+    def write_rows(self, rows):
+        if not self._table or not rows:
+            return
+        if not all(isinstance(row, dict) for row in rows):
+            self._table = False
+            self._columns = {}
+            return
+        for row in rows:
+            for column_name in row:
+                if column_name not in self._columns:
+                    self._columns[column_name] = [_ColumnStats(), self._row_count, []]
+        self._file.seek(0, os.SEEK_END)
+        for column_name, (stats, _, offsets) in self._columns.iteritems():
+            values = [row.get(column_name) for row in rows]
+            stats.add(values)
+            offsets.append(self._file.tell())
+            cPickle.dump(values, self._file, cPickle.HIGHEST_PROTOCOL)
+        self._row_count += len(rows)
+
+    def close(self):
+        try:
+            if not self._table or not self._row_count:
+                return
+            writer = self._writer
+            directory = writer._get_directory(self._miner_name, self._container_name)
+            columns = []
+            for column_index, column_name in enumerate(sorted(self._columns, key=natural_sort)):
+                stats, padding, offsets = self._columns[column_name]
+                stats.add_missing(padding)
+                columns.append(writer._write_column(
+                    directory, column_index, column_name, stats,
+                    lambda padding=padding, offsets=offsets: self.__chunk_iter(padding, offsets)))
+            writer._write_meta(directory, None, self._row_count, columns)
+        finally:
+            self._file.close()
+
+    def abort(self):
+        self._file.close()
+
+    def __chunk_iter(self, padding, offsets):
+        """Iterate over values of column, starting with missing values of rows which did not have it."""
+        for start in xrange(0, padding, PADDING_CHUNK_SIZE):
+            yield [None] * min(PADDING_CHUNK_SIZE, padding - start)
+        for offset in offsets:
+            self._file.seek(offset)
+            yield cPickle.load(self._file)
+
+
+class _ColumnStats(object):
+    """Kinds of values met in column, which define how column is stored."""
+
+    def __init__(self):
+        self.count = 0
+        self.missing = False
+        # Format: {kind of value}
+        self.kinds = set()
+        # When set, all integer values fit into 32 bits
+        self.int32 = True
+
+    def add(self, values):
+        self.count += len(values)
+        for v in values:
+            if v is None:
+                self.missing = True
+                continue
+            kind = _kind_map.get(type(v), u'json')
+            self.kinds.add(kind)
+            if kind == u'int' and not -0x80000000 <= v <= 0x7fffffff:
+                self.int32 = False
+
+    def add_missing(self, count):
+        self.count += count
+        if count:
+            self.missing = True
+
+    def get_kind(self):
+        """Define how values of column are stored: as bool, int, float, str or json."""
+        kinds = self.kinds
+        if len(kinds) == 1:
+            return next(iter(kinds))
+        if kinds == {u'int', u'float'}:
+            return u'float'
+        # Column without values at all
+        if not kinds:
+            return u'bool'
+        return u'json'
+
+
+# Format: {python type: kind of column}
+_kind_map = {
+    types.BooleanType: u'bool',
+    types.IntType: u'int',
+    types.LongType: u'int',
+    types.FloatType: u'float',
+    types.StringType: u'str',
+    types.UnicodeType: u'str'}
@@ -1,18 +1,49 @@
-import codecs
+import gzip
 import json
 import os.path
 import re
 import types
+import zlib
 from collections import OrderedDict
 from itertools import izip_longest
 
+from util import stage_stats
+from .atomic_file import AtomicFile
 from .base import BaseWriter
 
+try:
+    # Zstandard compression is available only when its package is installed
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+_split_numbers = re.compile('([0-9]+)').split
+# Keys are the same for field names of every row, thus sort keys of strings are remembered
+# Format: {string: sort key}
+_natural_keys = {}
+# Amount of remembered sort keys, after which they are forgotten
+NATURAL_KEYS_LIMIT = 100000
+# Amount of characters collected before they are encoded and written into file
+BUFFER_SIZE = 1024 * 1024
+
 
 def natural_sort(i):
-    if isinstance(i, (str, unicode)):
-        return [int(text) if text.isdigit() else text.lower() for text in re.split('([0-9]+)', i)]
-    return i
+    if not isinstance(i, (str, unicode)):
+        return i
+    try:
+        return _natural_keys[i]
+    except KeyError:
+        pass
+    if i.isdigit():
+        # Same as what splitting produces for string of single number
+        key = ['', int(i), '']
+    else:
+        key = [int(text) if text.isdigit() else text.lower() for text in _split_numbers(i)]
+    if len(_natural_keys) >= NATURAL_KEYS_LIMIT:
+        _natural_keys.clear()
+    _natural_keys[i] = key
+    return key
 
 
 class CustomEncoder(json.JSONEncoder):
@@ -78,34 +109,159 @@ class JsonWriter(BaseWriter):
     as JSON files.
     """
 
-    def __init__(self, directory, indent=None, group=None):
+    def __init__(self, directory, indent=None, group=None, compression=None, compression_level=None,
+                 compression_threads=0, fsync='never', manifest=None, shard=None):
+        if compression is not None and compression not in self._compression_extensions:
+            raise ValueError(u'unknown compression {}'.format(compression))
+        if shard is not None and shard[0] not in self._sharding_map:
+            raise ValueError(u'unknown sharding mode {}'.format(shard[0]))
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError(u'zstd compression requires zstandard package')
         self.base_dir = directory
         self.indent = indent
         self.group = group
+        # Files are compressed while they are written, with gzip or zstd
+        self.compression = compression
+        # Library default is used when level is not specified
+        self.compression_level = compression_level
+        # Amount of threads zstd compresses with, 0 disables threading and -1 uses all CPU cores
+        self.compression_threads = compression_threads
+        # Policy of flushing files to storage device, see AtomicFile
+        self.fsync = fsync
+        # Manifest of written files; files whose contents did not change are not replaced
+        self.manifest = manifest
+        # Maps are split into files by key, either into ranges of keys of this size,
+        # or into this amount of files by hash of key
+        # Format: ('range' or 'hash', size of range or amount of files)
+        self.shard = shard
 
     def write(self, miner_name, container_name, container_data):
-        # Create directory structure to path, if not created yet
-        directory = os.path.join(self.base_dir, self.__secure_name(miner_name))
-        if not os.path.exists(directory):
-            os.makedirs(directory, mode=0o755)
-
+        directory = self._get_directory(miner_name)
+        if self.shard is not None and isinstance(container_data, dict):
+            if self._write_shards(directory, container_name, container_data):
+                return
         data_type = type(container_data)
         grouping_method = self._grouping_map.get(data_type)
         if self.group is None or grouping_method is None:
-            filepath = os.path.join(directory, u'{}.json'.format(self.__secure_name(container_name)))
+            filepath = self._get_filepath(directory, container_name)
             self.__write_file(container_data, filepath)
         else:
             for i, group_data in enumerate(grouping_method(self, container_data)):
-                filepath = os.path.join(directory, u'{}.{}.json'.format(self.__secure_name(container_name), i))
+                filepath = self._get_filepath(directory, container_name, part=i)
                 self.__write_file(group_data, filepath)
 
+    def _write_shards(self, directory, container_name, container_data):
+        """
+        Write map as shard files, and index which describes them. Return
+        False if map cannot be sharded.
+        """
+        mode, value = self.shard
+        # Format: {shard file name suffix: shard data}
+        shards = self._sharding_map[mode](self, container_data, value)
+        if shards is None:
+            return False
+        # Format: [{file: shard file name, ...}]
+        shard_infos = []
+        for suffix, (shard_info, shard_data) in shards.iteritems():
+            filepath = self._get_filepath(directory, container_name, part=suffix)
+            self.__write_file(shard_data, filepath)
+            shard_info[u'file'] = os.path.basename(filepath)
+            shard_info[u'count'] = len(shard_data)
+            shard_infos.append(shard_info)
+        index = OrderedDict()
+        index[u'mode'] = mode
+        if mode == 'range':
+            index[u'size'] = value
+        else:
+            index[u'hash'] = u'crc32'
+            index[u'count'] = value
+        index[u'shards'] = shard_infos
+        self.__write_file(index, self._get_filepath(directory, container_name, part=u'index'))
+        return True
+
+    def _shard_by_range(self, container_data, size):
+        """
+        Split map with integer keys into ranges of keys.
+        Format: {suffix: ({first: first key, last: last key}, shard data)}
+        """
+        if not all(type(k) in (int, long) for k in container_data):
+            return None
+        shards = {}
+        for k in self.__get_keys(container_data):
+            first = k // size * size
+            try:
+                shard_data = shards[first][1]
+            except KeyError:
+                shard_data = type(container_data)()
+                shards[first] = (OrderedDict(((u'first', first), (u'last', first + size - 1))), shard_data)
+            shard_data[k] = container_data[k]
+        return OrderedDict((u'{}-{}'.format(first, first + size - 1), shards[first]) for first in sorted(shards))
+
+    def _shard_by_hash(self, container_data, count):
+        """
+        Split map into passed amount of parts by CRC32 of key as UTF-8 string.
+        Format: {suffix: ({hash: remainder of hash of keys}, shard data)}
+        """
+        shards = OrderedDict(
+            (u'hash{}'.format(i), (OrderedDict(((u'hash', i),)), type(container_data)())) for i in xrange(count))
+        for k in self.__get_keys(container_data):
+            i = (zlib.crc32(unicode(k).encode('utf-8')) & 0xffffffff) % count
+            shards[u'hash{}'.format(i)][1][k] = container_data[k]
+        return shards
+
+    _sharding_map = {
+        'range': _shard_by_range,
+        'hash': _shard_by_hash}
+
+    def open_stream(self, miner_name, container_name):
+        return JsonRowSink(self, miner_name, container_name)
+
+    def close(self):
+        if self.manifest is not None:
+            self.manifest.write()
+
+    def _get_directory(self, miner_name):
+        # Create directory structure to path, if not created yet
+        directory = os.path.join(self.base_dir, self.__secure_name(miner_name))
+        if not os.path.exists(directory):
+            os.makedirs(directory, mode=0o755)
+        return directory
+
+    def _get_filepath(self, directory, container_name, part=None):
+        extension = u'.json' + self._compression_extensions.get(self.compression, u'')
+        if part is None:
+            return os.path.join(directory, u'{}{}'.format(self.__secure_name(container_name), extension))
+        return os.path.join(directory, u'{}.{}{}'.format(self.__secure_name(container_name), part, extension))
+
+    def _open_file(self, filepath):
+        """Open file for writing text, which is compressed on the way if needed."""
+        atomic_file = AtomicFile(filepath, fsync=self.fsync, manifest=self.manifest)
+        if self.compression is None:
+            stream = None
+        elif self.compression == 'gzip':
+            level = 9 if self.compression_level is None else self.compression_level
+            # Zero modification time, so that the same data always produces the same file
+            stream = gzip.GzipFile(
+                filename=os.path.basename(filepath), mode='wb', compresslevel=level, fileobj=atomic_file, mtime=0)
+        else:
+            stream = ZstdStream(atomic_file, level=self.compression_level, threads=self.compression_threads)
+        return TextFile(atomic_file, stream=stream)
+
+    def _get_encoder(self):
+        return CustomEncoder(
+            ensure_ascii=False,
+            indent=self.indent,
+            # We're handling sorting in customized encoder
+            sort_keys=False)
+
     def _group_dict(self, container_data):
-        group_data = {}
-        for k in sorted(container_data, key=natural_sort):
+        # Groups are of the same type as container, so that ordered dictionaries keep their order
+        group_data = type(container_data)()
+        for k in self.__get_keys(container_data):
             group_data[k] = container_data[k]
             if len(group_data) >= self.group:
                 yield group_data
-                group_data = {}
+                group_data = type(container_data)()
         if group_data:
             yield group_data
 
@@ -119,21 +275,28 @@ class JsonWriter(BaseWriter):
         if group_data:
             yield group_data
 
+    # Format: {compression: file extension}
+    _compression_extensions = {
+        'gzip': u'.gz',
+        'zstd': u'.zst'}
+
     _grouping_map = {
         types.DictType: _group_dict,
+        OrderedDict: _group_dict,
         types.TupleType: _group_list,
         types.ListType: _group_list}
 
+    def __get_keys(self, container_data):
+        # Ordered dictionaries are already sorted
+        if isinstance(container_data, OrderedDict):
+            return list(container_data)
+        return sorted(container_data, key=natural_sort)
+
     def __write_file(self, data, filepath):
-        with codecs.open(filepath, 'wb', encoding='utf-8') as f:
-            json.dump(
-                data,
-                f,
-                ensure_ascii=False,
-                cls=CustomEncoder,
-                indent=self.indent,
-                # We're handling sorting in customized encoder
-                sort_keys=False)
+        with self._open_file(filepath) as f:
+            for chunk in self._get_encoder().iterencode(data):
+                f.write(chunk)
+        stage_stats.add_bytes(written=os.path.getsize(filepath))
 
     def __secure_name(self, name):
         """
@@ -145,3 +308,136 @@ class JsonWriter(BaseWriter):
         # underscore
         writer_safe_name = re.sub(r'[^\w\-.,() ]', '_', name, flags=re.UNICODE)
         return writer_safe_name
+
+
+class JsonRowSink(object):
+    """
+    Writes rows into JSON file as they come, producing the same
+    output as JSON writer does for list of all those rows.
+    """
+
+    def __init__(self, writer, miner_name, container_name):
+        self._writer = writer
+        self._directory = writer._get_directory(miner_name)
+        self._container_name = container_name
+        self._encoder = writer._get_encoder()
+        self._row_prefix = u'' if writer.indent is None else u'\n' + u' ' * writer.indent
+        self._file = None
+        # Format: [path to file which is completely written]
+        self._filepaths = []
+        # Amount of rows written into current file
+        self._row_count = 0
+
+    def write_rows(self, rows):
+        group = self._writer.group
+        for row in rows:
+            if self._file is None:
+                self._open_file()
+            elif group is not None and self._row_count >= group:
+                self._close_file()
+                self._open_file()
+            elif self._row_count:
+                self._file.write(u', ')
+            self._write_row(row)
+
+    def close(self):
+        # Without grouping, empty container still gets its file
+        if self._file is None and self._writer.group is None:
+            self._open_file()
+        if self._file is not None:
+            self._close_file()
+
+    def abort(self):
+        """Get rid of everything written so far."""
+        if self._file is not None:
+            self._file.abort()
+            self._file = None
+        for filepath in self._filepaths:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+    def _write_row(self, row):
+        text = u''.join(self._encoder.iterencode(row))
+        if self._row_prefix:
+            # Row is nested into list, thus it is indented one level deeper
+            text = self._row_prefix + text.replace(u'\n', self._row_prefix)
+        self._file.write(text)
+        self._row_count += 1
+
+    def _open_file(self):
+        part = None if self._writer.group is None else len(self._filepaths)
+        filepath = self._writer._get_filepath(self._directory, self._container_name, part=part)
+        self._file = self._writer._open_file(filepath)
+        self._file.write(u'[')
+        self._row_count = 0
+
+    def _close_file(self):
+        if self._row_count and self._row_prefix:
+            self._file.write(u'\n')
+        self._file.write(u']')
+        self._file.close()
+        self._filepaths.append(self._file.filepath)
+        self._file = None
+        stage_stats.add_bytes(written=os.path.getsize(self._filepaths[-1]))
+
+
+class TextFile(object):
+    """
+    Collects text written into it, and passes it on encoded to UTF-8
+    in big pieces, rather than encoding every small chunk separately.
+    """
+
+    def __init__(self, atomic_file, stream=None):
+        self.filepath = atomic_file.filepath
+        self._file = atomic_file
+        # Stream which compresses data on its way to file, if any
+        self._stream = stream if stream is not None else atomic_file
+        self._buffer = []
+        # Amount of characters in buffer
+        self._buffered = 0
+
+    def write(self, text):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= BUFFER_SIZE:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        if self._stream is not self._file:
+            self._stream.close()
+        self._file.close()
+
+    def abort(self):
+        self._buffer = []
+        self._file.abort()
+
+    def _flush(self):
+        if self._buffer:
+            self._stream.write(u''.join(self._buffer).encode('utf-8'))
+            self._buffer = []
+            self._buffered = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class ZstdStream(object):
+    """Compresses everything written into it with zstd, and passes it to file."""
+
+    def __init__(self, fileobj, level=None, threads=0):
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level, threads=threads)
+        self._stream = compressor.stream_writer(fileobj)
+
+    def write(self, data):
+        self._stream.write(data)
+
+    def close(self):
+        # Finish the frame, otherwise tail of data stays in compressor
+        self._stream.flush(zstandard.FLUSH_FRAME)
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+
+from .atomic_file import AtomicFile
+
+
+class Manifest(object):
+    """
+    Keeps hashes of files written into directory, and stores them
+    as manifest file there. Files whose contents match files of the
+    same name which are already there, or which are in directory of
+    previous dump, do not need to be written again.
+    """
+
+    file_name = u'manifest.json'
+
+    def __init__(self, directory, previous_directory=None):
+        self._directory = directory
+        self._previous_directory = previous_directory
+        # Format: {relative file path: {'sha256': hash, 'size': size in bytes}}
+        self._files = {}
+        # Hashes listed by manifests of earlier dumps, to avoid reading files again
+        self._known_files = self.__load(directory)
+        self._previous_files = self.__load(previous_directory) if previous_directory else {}
+
+    def add(self, filepath, digest, size):
+        self._files[self.__get_relative_path(filepath)] = {u'sha256': digest, u'size': size}
+
+    def is_unchanged(self, filepath, digest, size):
+        """Check if file at passed path already has passed contents."""
+        return self.__matches(filepath, self._known_files.get(self.__get_relative_path(filepath)), digest, size)
+
+    def get_previous(self, filepath, digest, size):
+        """Return path to file with passed contents in previous dump, or None if there is no such file."""
+        if self._previous_directory is None:
+            return None
+        relative_path = self.__get_relative_path(filepath)
+        previous_filepath = os.path.join(self._previous_directory, relative_path)
+        if self.__matches(previous_filepath, self._previous_files.get(relative_path), digest, size):
+            return previous_filepath
+        return None
+
+    def write(self):
+        if not os.path.exists(self._directory):
+            os.makedirs(self._directory, mode=0o755)
+        # Files written by earlier runs stay listed, as long as they are still there
+        files = dict(
+            (k, v) for k, v in self._known_files.iteritems()
+            if os.path.isfile(os.path.join(self._directory, k)))
+        files.update(self._files)
+        data = {u'files': dict((k.replace(os.sep, u'/'), v) for k, v in files.iteritems())}
+        with AtomicFile(os.path.join(self._directory, self.file_name)) as f:
+            f.write(json.dumps(data, indent=2, separators=(',', ': '), sort_keys=True))
+
+    def __matches(self, filepath, known_file, digest, size):
+        try:
+            if os.path.getsize(filepath) != size:
+                return False
+        except OSError:
+            return False
+        # Files are not read again when there is manifest entry for them
+        if known_file is not None and known_file[u'size'] == size:
+            return known_file[u'sha256'] == digest
+        return self.__get_digest(filepath) == digest
+
+    def __get_digest(self, filepath):
+        file_hash = hashlib.sha256()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), ''):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    def __get_relative_path(self, filepath):
+        return os.path.relpath(filepath, self._directory)
+
+    def __load(self, directory):
+        """Read manifest from directory, if it has one."""
+        try:
+            with open(os.path.join(directory, self.file_name), 'rb') as f:
+                files = json.load(f)[u'files']
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            return {}
+        return dict((k.replace(u'/', os.sep), v) for k, v in files.iteritems())
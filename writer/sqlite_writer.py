@@ -0,0 +1,402 @@
+import cPickle
+import os.path
+import re
+import sqlite3
+import string
+import types
+from itertools import izip, repeat
+
+from util import stage_stats
+from .base import BaseWriter
+from .canonical import sorted_keys
+from .json_writer import CustomEncoder, natural_sort
+
+
+# The most columns table can have in SQLite built with default settings
+MAX_COLUMNS = 2000
+
+# Amount of streamed rows moved from staging table into container table at once
+STAGING_BATCH_SIZE = 5000
+
+
+class SqliteWriter(BaseWriter):
+    """
+    Class, which stores fetched data as tables of single
+    SQLite database, one table per container.
+
+    Containers which are lists of maps, or maps of maps, become tables
+    with column per map key; keys of outer map are stored in primary key
+    column. Any other container becomes key-value table, as well as
+    tables whose maps have more keys than SQLite allows columns, or
+    keys which differ only in case. Nested values are stored as JSON text.
+    """
+
+    # Name of table which lists all written containers
+    catalog_table = u'phobos_containers'
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._dbconn = None
+        self._encoder = CustomEncoder(ensure_ascii=False, separators=(',', ':'), sort_keys=False)
+
+    def write(self, miner_name, container_name, container_data):
+        keys, rows = self._get_rows(container_data)
+        layout = _Layout(keyed=keys is not None)
+        for row, key in izip(rows, keys if keys is not None else repeat(None)):
+            layout.add(row, key)
+        key_column, columns, split = layout.get_columns(
+            lambda column_name: len(set(row.get(column_name) for row in rows)) == len(rows))
+        self._begin_container()
+        try:
+            table_name = self._get_table_name(miner_name, container_name)
+            self._create_table(table_name, key_column, columns)
+            self._insert_rows(table_name, columns, split, rows, keys)
+            self._finish_container(miner_name, container_name, table_name, key_column)
+        except:
+            self._rollback_container()
+            raise
+
+    def open_stream(self, miner_name, container_name):
+        return SqliteRowSink(self, miner_name, container_name)
+
+    def close(self):
+        """Commit everything written so far."""
+        if self._dbconn is None:
+            return
+        self._dbconn.execute(u'commit')
+        self._dbconn.close()
+        self._dbconn = None
+        stage_stats.add_bytes(written=os.path.getsize(self.filepath))
+
+    def _get_connection(self):
+        """
+        Open database and start transaction, which is kept open
+        until writer is closed.
+        """
+        if self._dbconn is not None:
+            return self._dbconn
+        directory = os.path.dirname(self.filepath)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, mode=0o755)
+        # Transactions are handled manually. Writer can be used from writing thread and closed
+        # from main one, but never from both at once
+        dbconn = sqlite3.connect(self.filepath, isolation_level=None, check_same_thread=False)
+        dbconn.execute(u'begin')
+        dbconn.execute(
+            u'create table if not exists {} (miner text, container text, table_name text, key_column text, '
+            u'primary key (miner, container))'.format(self.catalog_table))
+        self._dbconn = dbconn
+        return dbconn
+
+    def _get_table_name(self, miner_name, container_name):
+        """
+        Compose table name out of miner and container names, which can
+        be used in queries without quoting, and is not taken by other
+        container. Container which was written before keeps its table.
+        """
+        c = self._dbconn.execute(
+            u'select table_name from {} where miner = ? and container = ?'.format(self.catalog_table),
+            (miner_name, container_name))
+        row = c.fetchone()
+        if row is not None:
+            self._dbconn.execute(
+                u'delete from {} where miner = ? and container = ?'.format(self.catalog_table),
+                (miner_name, container_name))
+            return row[0]
+        base_name = re.sub(r'\W+', '_', u'{}_{}'.format(miner_name, container_name)).strip(u'_').lower()
+        # Names starting with sqlite_ are reserved by SQLite
+        if base_name.startswith(u'sqlite_'):
+            base_name = u't_' + base_name
+        table_name = base_name
+        suffix = 1
+        while self.__table_exists(table_name) or table_name == self.catalog_table:
+            suffix += 1
+            table_name = u'{}_{}'.format(base_name, suffix)
+        return table_name
+
+    def _begin_container(self):
+        """
+        Every container is written under its own savepoint, so that failure
+        to write one of them does not leave half of it in the database.
+        """
+        self._get_connection().execute(u'savepoint container')
+
+    def _finish_container(self, miner_name, container_name, table_name, key_column):
+        self._dbconn.execute(
+            u'insert into {} (miner, container, table_name, key_column) values (?, ?, ?, ?)'.format(self.catalog_table),
+            (miner_name, container_name, table_name, key_column))
+        self._dbconn.execute(u'release container')
+
+    def _rollback_container(self):
+        self._dbconn.execute(u'rollback to container')
+        self._dbconn.execute(u'release container')
+
+    def _get_rows(self, container_data):
+        """
+        Return rows of container, and keys of outer map if container is map.
+        Format: ([key] or None, [row])
+        """
+        if isinstance(container_data, dict):
+            keys = sorted_keys(container_data)
+            return keys, [container_data[k] for k in keys]
+        if isinstance(container_data, (list, tuple)):
+            return None, container_data
+        return None, [container_data]
+
+    def _insert_rows(self, table_name, columns, split, rows, keys=None):
+        """Insert rows in the form layout defined for them."""
+        query = u'insert into {} ({}) values ({})'.format(
+            self.__quote(table_name),
+            u', '.join(self.__quote(c) for c, _ in columns),
+            u', '.join(u'?' for _ in columns))
+        # Format: [(column name, flag which tells if values are stored as JSON)]
+        column_encoding = [(c, stats.nested) for c, stats in columns]
+        value_encoding = column_encoding
+        if keys is not None:
+            key_nested = column_encoding[0][1]
+            value_encoding = column_encoding[1:]
+        if split:
+            value_iter = (tuple(self._encode_value(row.get(c), nested) for c, nested in value_encoding) for row in rows)
+        else:
+            nested = value_encoding[0][1]
+            value_iter = ((self._encode_value(row, nested),) for row in rows)
+        if keys is not None:
+            value_iter = ((self._encode_value(k, key_nested),) + v for k, v in izip(keys, value_iter))
+        self._dbconn.executemany(query, value_iter)
+
+    def _encode_value(self, value, nested):
+        """Convert value into something SQLite can store; values of nested columns are stored as JSON."""
+        value = self._convert_value(value)
+        if nested and value is not None:
+            return unicode(self._encoder.encode(value))
+        return value
+
+    def _create_table(self, table_name, key_column, columns):
+        column_definitions = []
+        for column_name, stats in columns:
+            definition = self.__quote(column_name)
+            column_type = stats.get_type()
+            if column_type:
+                definition = u'{} {}'.format(definition, column_type)
+            if column_name == key_column:
+                definition = u'{} primary key'.format(definition)
+            column_definitions.append(definition)
+        self._dbconn.execute(u'drop table if exists {}'.format(self.__quote(table_name)))
+        self._dbconn.execute(u'create table {} ({})'.format(self.__quote(table_name), u', '.join(column_definitions)))
+
+    def __table_exists(self, table_name):
+        c = self._dbconn.execute(u'select count(*) from sqlite_master where type = \'table\' and name = ?', (table_name,))
+        return bool(c.fetchone()[0])
+
+    def __quote(self, name):
+        return u'"{}"'.format(unicode(name).replace(u'"', u'""'))
+
+    def _convert_value(self, value):
+        """Convert value into something SQLite can store."""
+        if isinstance(value, str):
+            return value.decode('utf-8')
+        if isinstance(value, bool):
+            return int(value)
+        return value
+
+
+class SqliteRowSink(object):
+    """
+    Sink which stores rows in temporary staging table as they come, and
+    moves them into container table once layout of the whole table is
+    known, without holding rows in memory.
+    """
+
+    # Staging table lives in database of temporary objects, which is not part of written file
+    staging_table = u'temp.phobos_staging'
+
+    def __init__(self, writer, miner_name, container_name):
+        self._writer = writer
+        self._miner_name = miner_name
+        self._container_name = container_name
+        self._layout = _Layout(keyed=False)
+        # Integer values of columns which can turn out to be primary key are
+        # staged in separate columns, to check their uniqueness in SQL
+        # Format: {column name: staging column name}
+        self._id_columns = {}
+        writer._begin_container()
+        self._dbconn = writer._dbconn
+        try:
+            self._dbconn.execute(u'drop table if exists {}'.format(self.staging_table))
+            self._dbconn.execute(u'create table {} (row blob)'.format(self.staging_table))
+        except:
+            writer._rollback_container()
+            raise
+
+    def write_rows(self, rows):
+        layout = self._layout
+        id_columns = self._id_columns
+        for row in rows:
+            layout.add(row)
+            if not isinstance(row, dict):
+                continue
+            for column_name in row:
+                if column_name not in id_columns and unicode(column_name).endswith(u'ID'):
+                    id_columns[column_name] = u'c{}'.format(len(id_columns))
+                    self._dbconn.execute(u'alter table {} add column {}'.format(
+                        self.staging_table, id_columns[column_name]))
+        id_column_names = sorted(id_columns)
+        query = u'insert into {} (row{}) values (?{})'.format(
+            self.staging_table,
+            u''.join(u', {}'.format(id_columns[c]) for c in id_column_names),
+            u', ?' * len(id_column_names))
+        self._dbconn.executemany(query, (self.__get_staging_row(row, id_column_names) for row in rows))
+
+    def close(self):
+        try:
+            key_column, columns, split = self._layout.get_columns(self.__is_unique)
+            writer = self._writer
+            table_name = writer._get_table_name(self._miner_name, self._container_name)
+            writer._create_table(table_name, key_column, columns)
+            last_rowid = 0
+            while True:
+                c = self._dbconn.execute(
+                    u'select rowid, row from {} where rowid > ? order by rowid limit ?'.format(self.staging_table),
+                    (last_rowid, STAGING_BATCH_SIZE))
+                staged_rows = c.fetchall()
+                if not staged_rows:
+                    break
+                last_rowid = staged_rows[-1][0]
+                writer._insert_rows(table_name, columns, split, [cPickle.loads(str(r[1])) for r in staged_rows])
+            self._dbconn.execute(u'drop table {}'.format(self.staging_table))
+            writer._finish_container(self._miner_name, self._container_name, table_name, key_column)
+        except:
+            self._writer._rollback_container()
+            raise
+
+    def abort(self):
+        self._writer._rollback_container()
+
+    def __get_staging_row(self, row, id_column_names):
+        staging_row = [sqlite3.Binary(cPickle.dumps(row, cPickle.HIGHEST_PROTOCOL))]
+        for column_name in id_column_names:
+            value = row.get(column_name) if isinstance(row, dict) else None
+            staging_row.append(value if isinstance(value, (int, long)) else None)
+        return staging_row
+
+    def __is_unique(self, column_name):
+        c = self._dbconn.execute(u'select count(distinct {}) from {}'.format(
+            self._id_columns[column_name], self.staging_table))
+        return c.fetchone()[0] == self._layout.row_count
+
+
+class _ColumnStats(object):
+    """Kinds of values met in column, which define how column is stored."""
+
+    def __init__(self):
+        # SQLite types of values which are not nested
+        self.types = set()
+        # When set, column has nested values, and all its values are stored as JSON text
+        self.nested = False
+        # Amount of integer values; column which has them in all rows can be primary key
+        self.integers = 0
+
+    def add(self, value):
+        if isinstance(value, _nested_types):
+            self.nested = True
+        elif value is not None:
+            self.types.add(_column_type_map.get(type(value), u''))
+        if isinstance(value, (int, long)):
+            self.integers += 1
+
+    def get_type(self):
+        if self.nested:
+            return u'text'
+        if len(self.types) == 1:
+            return next(iter(self.types))
+        if self.types == {u'integer', u'real'}:
+            return u'real'
+        return u''
+
+
+class _Layout(object):
+    """
+    Collects what is known about rows of container as they are passed
+    to it, to define columns of table once all of them are seen.
+    """
+
+    def __init__(self, keyed):
+        # When set, rows come with keys of outer map, which are stored in key column
+        self.keyed = keyed
+        self.row_count = 0
+        self.key_stats = _ColumnStats()
+        # Stats of rows as a whole, for the case they are stored in single column
+        self.row_stats = _ColumnStats()
+        # Stats of every map key, while all rows are maps
+        # Format: {column name: column stats}
+        self.column_stats = {}
+        self.all_maps = True
+
+    def add(self, row, key=None):
+        self.row_count += 1
+        if self.keyed:
+            self.key_stats.add(key)
+        self.row_stats.add(row)
+        if not self.all_maps:
+            return
+        if not isinstance(row, dict):
+            self.all_maps = False
+            self.column_stats = {}
+            return
+        column_stats = self.column_stats
+        for column_name, value in row.iteritems():
+            try:
+                stats = column_stats[column_name]
+            except KeyError:
+                stats = column_stats[column_name] = _ColumnStats()
+            stats.add(value)
+
+    def get_columns(self, is_unique):
+        """
+        Define columns of table. Function, which tells if column of rows
+        has unique values, is used to pick primary key for lists of rows.
+        Format: (primary key column name or None, [(column name, column stats)],
+        flag which tells if rows are split into columns by map keys)
+        """
+        if self.all_maps and self.row_count:
+            column_names = sorted(self.column_stats, key=natural_sort)
+            columns = [(c, self.column_stats[c]) for c in column_names]
+            if self.keyed:
+                # Column names are compared the way SQLite does it, case-insensitively
+                folded_names = set(_fold_case(c) for c in column_names)
+                key_column = u'key'
+                while _fold_case(key_column) in folded_names:
+                    key_column = u'_' + key_column
+                columns.insert(0, (key_column, self.key_stats))
+            else:
+                key_column = None
+                for column_name, stats in columns:
+                    if (unicode(column_name).endswith(u'ID') and stats.integers == self.row_count and
+                            is_unique(column_name)):
+                        key_column = column_name
+                        break
+            if len(columns) <= MAX_COLUMNS and len(set(_fold_case(c) for c, _ in columns)) == len(columns):
+                return key_column, columns, True
+        columns = [(u'value', self.row_stats)]
+        if self.keyed:
+            return u'key', [(u'key', self.key_stats)] + columns, False
+        return None, columns, False
+
+
+def _fold_case(name):
+    """Convert name to lower case the way SQLite does it when comparing identifiers, i.e. ASCII letters only."""
+    return unicode(name).translate(_ascii_lowercase)
+
+
+_ascii_lowercase = dict((ord(c), ord(c.lower())) for c in string.ascii_uppercase)
+
+_nested_types = (types.DictType, types.TupleType, types.ListType)
+
+# Format: {python type: SQLite column type}
+_column_type_map = {
+    types.BooleanType: u'integer',
+    types.IntType: u'integer',
+    types.LongType: u'integer',
+    types.FloatType: u'real',
+    types.StringType: u'text',
+    types.UnicodeType: u'text'}